@@ -0,0 +1,176 @@
+"""Latency-budgeted inference at an adaptive processing resolution.
+
+A cost model per host and generator (backend and model), fitted on past
+runs, predicts the generator time from the processing pixel count. The first run of every input shape is cold
+(graph setup, cuDNN autotuning) and is not recorded; while a new host is
+calibrated the shape is warmed up with an extra untimed run instead. The
+full resolution upsampling is timed separately, per output pixel. Given a
+latency budget, the largest resolution whose generator time plus upsampling
+time fits is chosen, the generator runs at that size, and the result is
+brought back to full resolution with a guided filter that takes its edges
+from the original photo.
+"""
+import json
+import os
+import platform
+import time
+
+import cv2
+import numpy as np
+
+
+class CostModel(object):
+    """seconds = intercept + slope * pixels, fitted on the most recent runs of this host and generator"""
+
+    def __init__(self, path, key='', max_samples=200):
+        # key names the generator (e.g. backend and checkpoint), so switching runtime or model starts a new history
+        self.path = path
+        self.host = platform.node()
+        self.key = self.host + ('|' + key if key else '')
+        self.max_samples = max_samples
+        self.hosts = {}
+        if path and os.path.exists(path):
+            with open(path) as f:
+                self.hosts = json.load(f)
+        self.samples = self.hosts.setdefault(self.key, [])
+        self._fit()
+
+
+    def _fit(self):
+        self.intercept, self.slope = 0., None
+        if not self.samples:
+            return
+        pixels, seconds = np.asarray(self.samples, dtype=np.float64).T
+        if len(np.unique(pixels)) >= 2:
+            slope, intercept = np.polyfit(pixels, seconds, 1)
+            if slope > 0:
+                self.slope, self.intercept = slope, max(intercept, 0.)
+                return
+        # a single resolution so far: assume cost proportional to pixels
+        self.slope = float(np.mean(seconds / pixels))
+
+
+    @property
+    def ready(self):
+        return self.slope is not None
+
+
+    def predict(self, pixels):
+        return self.intercept + self.slope * pixels
+
+
+    def max_pixels(self, budget):
+        return max(budget - self.intercept, 0.) / self.slope
+
+
+    def record(self, pixels, seconds):
+        self.samples.append([float(pixels), float(seconds)])
+        del self.samples[:-self.max_samples]
+        self._fit()
+
+
+    def save(self):
+        if not self.path:
+            return
+        tmp_path = self.path + '.tmp'
+        with open(tmp_path, 'w') as f:
+            json.dump(self.hosts, f)
+        os.replace(tmp_path, self.path)
+
+
+def guided_upsample(low_out, guide, radius=2, eps=1e-3):
+    """Fast guided filter upsampling.
+
+    low_out: float32 [h, w, 3] generator output in [0, 1]
+    guide:   float32 [H, W, 3] original photo in [0, 1]
+    The local linear model output = a * gray(guide) + b is fitted at low
+    resolution, its coefficients are upsampled, and applied to the full
+    resolution guide, so edges come from the photo and colours from the output.
+    """
+    h, w = low_out.shape[:2]
+    H, W = guide.shape[:2]
+    guide_gray = cv2.cvtColor(guide, cv2.COLOR_RGB2GRAY)
+    low_gray = cv2.resize(guide_gray, (w, h), interpolation=cv2.INTER_AREA)[..., np.newaxis]
+
+    ksize = (2 * radius + 1, 2 * radius + 1)
+    box = lambda x: cv2.boxFilter(x, -1, ksize, borderType=cv2.BORDER_REFLECT).reshape(x.shape)
+    mean_i = box(low_gray)
+    mean_p = box(low_out)
+    cov_ip = box(low_gray * low_out) - mean_i * mean_p
+    var_i = box(low_gray * low_gray) - mean_i * mean_i
+
+    a = cov_ip / (var_i + eps)
+    b = mean_p - a * mean_i
+    mean_a = cv2.resize(box(a), (W, H), interpolation=cv2.INTER_LINEAR)
+    mean_b = cv2.resize(box(b), (W, H), interpolation=cv2.INTER_LINEAR)
+    return np.clip(mean_a * guide_gray[..., np.newaxis] + mean_b, 0., 1.)
+
+
+class AdaptiveResolution(object):
+
+    def __init__(self, infer_fn, budget, cost_model_path, cost_key='', min_side=64, probe_side=512, align=32):
+        # infer_fn maps a float32 batch [1, h, w, 3] in [-1, 1] to the generated batch in [-1, 1];
+        # cost_key identifies the generator behind it for the cost model
+        self.infer_fn = infer_fn
+        self.budget = budget
+        self.cost_model = CostModel(cost_model_path, cost_key)
+        self.min_side = min_side
+        self.probe_side = probe_side
+        self.align = align
+        # processing shapes already run once in this process; their first run is not representative
+        self.warm_shapes = set()
+        # seconds of guided upsampling per full resolution pixel, measured in this process
+        self.upsample_rate = None
+
+
+    def choose_size(self, H, W):
+        if self.cost_model.ready and self.cost_model.predict(H * W) <= self.budget:
+            scale = 1.
+        elif self.cost_model.ready:
+            # below full resolution the guided upsampling to H x W is paid on top of the generator
+            upsample = self.upsample_rate * H * W if self.upsample_rate is not None else 0.
+            scale = np.sqrt(self.cost_model.max_pixels(self.budget - upsample) / float(H * W))
+        else:
+            # no history for this host and generator yet: calibrate at a moderate size
+            scale = self.probe_side / float(max(H, W))
+        scale = min(scale, 1.)
+        fit = lambda x: min(x, max(self.min_side, int(x * scale) // self.align * self.align))
+        return fit(H), fit(W)
+
+
+    def __call__(self, image):
+        # image: float32 [1, H, W, 3] in [-1, 1]; returns the generated image at the same size and run info
+        start_time = time.time()
+        H, W = image.shape[1:3]
+        h, w = self.choose_size(H, W)
+        predicted = self.cost_model.predict(h * w) if self.cost_model.ready else None
+
+        low = image if (h, w) == (H, W) else cv2.resize(image[0], (w, h), interpolation=cv2.INTER_AREA)[np.newaxis]
+        cold = (h, w) not in self.warm_shapes
+        self.warm_shapes.add((h, w))
+        if cold and not self.cost_model.ready:
+            # calibrating on a new host: warm this shape up so the first sample is already usable
+            self.infer_fn(low)
+            cold = False
+        infer_start = time.time()
+        generated = self.infer_fn(low)
+        generator_time = time.time() - infer_start
+
+        if (h, w) != (H, W):
+            upsample_start = time.time()
+            generated = guided_upsample((generated[0] + 1.) / 2., (image[0] + 1.) / 2.) * 2. - 1.
+            generated = generated[np.newaxis].astype(np.float32)
+            rate = (time.time() - upsample_start) / float(H * W)
+            self.upsample_rate = rate if self.upsample_rate is None else 0.8 * self.upsample_rate + 0.2 * rate
+
+        # the cost model is fitted on the generator alone
+        if not cold:
+            self.cost_model.record(h * w, generator_time)
+
+        elapsed = time.time() - start_time
+        return generated, {'size': (h, w), 'full_size': (H, W), 'predicted': predicted, 'elapsed': elapsed,
+                           'generator_time': generator_time, 'cold': cold}
+
+
+    def save(self):
+        self.cost_model.save()
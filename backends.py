@@ -0,0 +1,181 @@
+"""Pluggable inference backends for the generator.
+
+'tf'   inference.GeneratorSession, a generator-only TensorFlow session.
+'onnx' ONNX Runtime on a model exported from the same checkpoint. The
+       generator graph is frozen and converted with tf2onnx the first time,
+       and the .onnx file is cached next to the checkpoint.
+
+Every backend takes and returns float32 [b, h, w, 3] batches in [-1, 1], so
+callers switch runtimes with a flag. Run this module to check a backend
+against the TensorFlow reference on sample images and compare their latency
+and throughput side by side:
+
+    python backends.py --checkpoint_dir checkpoint/AnimeStyle_TWR_... --backends tf onnx
+"""
+import argparse
+import json
+import os
+import time
+
+import numpy as np
+
+from inference import Backend, GeneratorSession, checkpoint_path, load_student_config
+
+BACKENDS = ('tf', 'onnx')
+
+# outputs are in [-1, 1]; one 8 bit level is 2 / 255
+PARITY_MAX_ABS = 4. / 255
+PARITY_MEAN_ABS = 0.5 / 255
+
+
+def export_onnx(checkpoint_dir, epoch=None, onnx_path=None, opset=13):
+    # freeze the generator of a checkpoint and convert it; returns the path of the (cached) .onnx file
+    import tensorflow as tf
+    import tf2onnx
+
+    path = checkpoint_path(checkpoint_dir, epoch)
+    if onnx_path is None:
+        onnx_path = os.path.join(checkpoint_dir, 'onnx', os.path.basename(path) + '.onnx')
+    if os.path.exists(onnx_path) and os.path.getmtime(onnx_path) >= os.path.getmtime(path + '.index'):
+        return onnx_path
+
+    generator = GeneratorSession(checkpoint_dir, epoch)
+    with generator.graph.as_default():
+        frozen = tf.graph_util.convert_variables_to_constants(
+            generator.sess, generator.graph.as_graph_def(), [generator.test_generated.op.name])
+    generator.close()
+
+    folder = os.path.dirname(onnx_path)
+    if folder and not os.path.exists(folder):
+        os.makedirs(folder)
+    tmp_path = onnx_path + '.tmp'
+    tf2onnx.convert.from_graph_def(frozen, input_names=[generator.test_real.name],
+                                   output_names=[generator.test_generated.name], opset=opset, output_path=tmp_path)
+    os.replace(tmp_path, onnx_path)
+    print(" [*] Exported {} to {}".format(path, onnx_path))
+    return onnx_path
+
+
+class OnnxBackend(Backend):
+
+    name = 'onnx'
+
+    def __init__(self, onnx_path, threads=4, providers=None):
+        import onnxruntime as ort
+
+        options = ort.SessionOptions()
+        options.intra_op_num_threads = threads
+        options.inter_op_num_threads = threads
+        options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        self.session = ort.InferenceSession(onnx_path, options, providers=providers or ort.get_available_providers())
+        self.input_name = self.session.get_inputs()[0].name
+        self.path = onnx_path
+
+
+    def run(self, batch):
+        return self.session.run(None, {self.input_name: np.ascontiguousarray(batch, dtype=np.float32)})[0]
+
+
+def create_backend(name, checkpoint_dir, epoch=None, threads=4):
+    # checkpoint_dir is the model specific folder, as for GeneratorSession
+    if name == 'tf':
+        return GeneratorSession(checkpoint_dir, epoch, threads=threads)
+    if name == 'onnx':
+        return OnnxBackend(export_onnx(checkpoint_dir, epoch), threads)
+    raise ValueError("Unknown backend {}, expected one of {}".format(name, ', '.join(BACKENDS)))
+
+
+def check_parity(reference, candidate, images, max_abs=PARITY_MAX_ABS, mean_abs=PARITY_MEAN_ABS):
+    # images: float32 [1, h, w, 3] in [-1, 1]; compares the candidate's outputs with the reference backend's
+    per_image = []
+    for image in images:
+        diff = np.abs(reference.run(image).astype(np.float64) - candidate.run(image))
+        per_image.append({'size': list(image.shape[1:3]), 'max_abs': float(diff.max()), 'mean_abs': float(diff.mean())})
+    worst_max = max(r['max_abs'] for r in per_image) if per_image else 0.
+    worst_mean = max(r['mean_abs'] for r in per_image) if per_image else 0.
+    return {'passed': worst_max <= max_abs and worst_mean <= mean_abs, 'max_abs': worst_max, 'mean_abs': worst_mean,
+            'tolerance': {'max_abs': max_abs, 'mean_abs': mean_abs}, 'images': per_image}
+
+
+def measure_backend(backend, size, batch_size=4, warmup=2, repeat=10, seed=0):
+    # median single-image latency and batched throughput at a square size
+    rng = np.random.RandomState(seed)
+    single = rng.uniform(-1, 1, size=(1, size, size, 3)).astype(np.float32)
+    batch = rng.uniform(-1, 1, size=(batch_size, size, size, 3)).astype(np.float32)
+
+    def timed(x):
+        for _ in range(warmup):
+            backend.run(x)
+        times = []
+        for _ in range(repeat):
+            start_time = time.perf_counter()
+            backend.run(x)
+            times.append(time.perf_counter() - start_time)
+        return float(np.median(times))
+
+    latency = timed(single)
+    batch_time = timed(batch)
+    return {'size': size, 'latency': latency, 'batch_size': batch_size, 'images_per_second': batch_size / batch_time}
+
+
+def parse_args():
+    desc = "Compare AnimeStyle inference backends"
+    parser = argparse.ArgumentParser(description=desc)
+
+    parser.add_argument('--checkpoint_dir', type=str, required=True, help='model specific checkpoint folder')
+    parser.add_argument('--epoch', type=int, default=None, help='checkpoint epoch, latest if omitted')
+    parser.add_argument('--backends', type=str, nargs='+', default=list(BACKENDS), help='backends to compare; the first is the reference')
+    parser.add_argument('--test_dir', type=str, default='./dataset/test', help='sample images for the parity check')
+    parser.add_argument('--img_size', type=int, nargs=2, default=[256, 256], help='size of input image')
+    parser.add_argument('--max_images', type=int, default=20, help='sample images used for the parity check')
+    parser.add_argument('--max_abs', type=float, default=PARITY_MAX_ABS, help='allowed max abs difference in [-1, 1] units')
+    parser.add_argument('--mean_abs', type=float, default=PARITY_MEAN_ABS, help='allowed mean abs difference in [-1, 1] units')
+    parser.add_argument('--sizes', type=str, default='256,512,1024', help='square sizes for the latency comparison')
+    parser.add_argument('--batch_size', type=int, default=4, help='batch size for the throughput comparison')
+    parser.add_argument('--repeat', type=int, default=10, help='timed runs per measurement')
+    parser.add_argument('--threads', type=int, default=4, help='intra/inter op threads of every backend')
+    parser.add_argument('--report', type=str, default='', help='write parity and timings to this JSON file')
+
+    return parser.parse_args()
+
+
+"""main"""
+def main():
+    args = parse_args()
+    from tools.utils import load_test_data
+    from evaluate import list_images
+
+    if load_student_config(args.checkpoint_dir) is not None:
+        print(" [*] Student checkpoint: comparing the student network")
+    images = [np.asarray(load_test_data(f, args.img_size)) for f in list_images(args.test_dir)[:args.max_images]]
+    backends = [create_backend(name, args.checkpoint_dir, args.epoch, args.threads) for name in args.backends]
+
+    report = {'parity': {}, 'timing': {}}
+    reference = backends[0]
+    for backend in backends[1:]:
+        parity = check_parity(reference, backend, images, args.max_abs, args.mean_abs)
+        report['parity'][backend.name] = parity
+        print(" [*] %s vs %s on %d images: max abs %.5f, mean abs %.6f -- %s" % (
+            backend.name, reference.name, len(images), parity['max_abs'], parity['mean_abs'],
+            'OK' if parity['passed'] else 'FAILED'))
+
+    print(" [*] %-6s %6s %14s %16s" % ('', 'size', 'latency (ms)', 'images/s (b%d)' % args.batch_size))
+    for backend in backends:
+        report['timing'][backend.name] = []
+        for size in [int(s) for s in args.sizes.split(',')]:
+            timing = measure_backend(backend, size, args.batch_size, repeat=args.repeat)
+            report['timing'][backend.name].append(timing)
+            print(" [*] %-6s %6d %14.2f %16.2f" % (backend.name, size, timing['latency'] * 1e3, timing['images_per_second']))
+
+    for backend in backends:
+        backend.close()
+    if args.report:
+        with open(args.report, 'w') as f:
+            json.dump(report, f, indent=2)
+        print("Report is saved in " + args.report)
+    if not all(parity['passed'] for parity in report['parity'].values()):
+        exit(1)
+
+
+if __name__ == '__main__':
+    main()
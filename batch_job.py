@@ -0,0 +1,294 @@
+"""Sharded, resumable batch inference.
+
+A job lives in a directory shared by every worker (e.g. on NFS):
+
+    <job_dir>/manifest.json        sorted list of input files, written once
+    <job_dir>/done/<key>.json      one marker per finished item
+    <job_dir>/stats/<shard>.json   throughput of each worker run
+    <job_dir>/stats.json           merged statistics
+
+Every item is assigned to shard sha1(relative path) % num_shards, so each
+worker computes its own share from the manifest without talking to the
+others. An item is marked done only after its output files are complete,
+and markers and the manifest are written to a temporary file and renamed,
+so a crashed or killed worker leaves nothing half written and a rerun skips
+what is finished. Run one process per shard on any number of hosts with
+--shard, or omit --shard to start all shards as local processes.
+
+    python batch_job.py --job_dir /shared/job --input_dir /shared/photos \\
+        --checkpoint_dir checkpoint/AnimeStyle_TWR_... --num_shards 8 --shard 3
+"""
+import argparse
+import hashlib
+import json
+import os
+import platform
+import subprocess
+import sys
+import threading
+import time
+
+MANIFEST = 'manifest.json'
+
+
+def parse_args():
+    desc = "AnimeStyle batch inference job"
+    parser = argparse.ArgumentParser(description=desc)
+
+    parser.add_argument('--job_dir', type=str, required=True, help='shared folder coordinating the workers')
+    parser.add_argument('--input_dir', type=str, default='./dataset/test', help='images to process, searched recursively')
+    parser.add_argument('--output_dir', type=str, default='', help='output folder, <job_dir>/output by default')
+    parser.add_argument('--checkpoint_dir', type=str, default='', help='model specific checkpoint folder')
+    parser.add_argument('--epoch', type=int, default=None, help='checkpoint epoch, latest if omitted')
+    parser.add_argument('--img_size', type=int, nargs=2, default=[256, 256], help='size of input image')
+    parser.add_argument('--max_side', type=int, default=0, help='cap on the longer side of processed images, 0 for no cap')
+    parser.add_argument('--num_shards', type=int, default=1, help='number of shards the manifest is split into')
+    parser.add_argument('--shard', type=int, default=-1, help='shard processed by this worker, -1 to run all locally')
+    parser.add_argument('--threads', type=int, default=0, help='intra/inter op threads per worker, 0 to split the CPUs')
+    parser.add_argument('--out_format', type=str, default='jpg', help='format of saved images: jpg, png or webp')
+    parser.add_argument('--out_quality', type=int, default=95, help='encoding quality 0-100 of saved jpg/webp images')
+    parser.add_argument('--save_real', type=int, default=0, help='also save the resized input photo (_a)')
+    parser.add_argument('--merge', action='store_true', help='only merge the statistics of finished runs')
+
+    return check_args(parser.parse_args())
+
+
+def check_args(args):
+    if not args.merge and not args.checkpoint_dir:
+        print('--checkpoint_dir is required')
+        return None
+    if args.num_shards < 1 or args.shard >= args.num_shards:
+        print('--shard must be in [0, num_shards)')
+        return None
+    if not 0 <= args.out_quality <= 100:
+        print('--out_quality must be in [0, 100]')
+        return None
+    if not args.output_dir:
+        args.output_dir = os.path.join(args.job_dir, 'output')
+    return args
+
+
+def atomic_write_json(path, data):
+    # readers see either the previous file or the complete new one; the temporary name is unique per writer
+    tmp_path = '%s.%s.%d.%d.tmp' % (path, platform.node(), os.getpid(), threading.get_ident())
+    with open(tmp_path, 'w') as f:
+        json.dump(data, f, indent=2)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+
+
+def item_key(relpath):
+    return hashlib.sha1(relpath.replace(os.sep, '/').encode('utf-8')).hexdigest()
+
+
+def shard_of(key, num_shards):
+    return int(key[:8], 16) % num_shards
+
+
+def load_manifest(job_dir):
+    path = os.path.join(job_dir, MANIFEST)
+    if not os.path.exists(path):
+        return None
+    with open(path) as f:
+        return json.load(f)
+
+
+def output_stems(files):
+    # a/b.jpg -> a/b; files that would share a stem (a/b.jpg and a/b.png) keep their extension: a/b_jpg, a/b_png
+    stems = [os.path.splitext(f)[0] for f in files]
+    counts = {}
+    for stem in stems:
+        counts[stem.lower()] = counts.get(stem.lower(), 0) + 1
+    return [stem + '_' + os.path.splitext(f)[1].lstrip('.') if counts[stem.lower()] > 1 else stem
+            for f, stem in zip(files, stems)]
+
+
+def build_manifest(job_dir, input_dir):
+    # the first worker writes the manifest; later workers and reruns reuse it, so every shard sees the same items
+    manifest = load_manifest(job_dir)
+    if manifest is not None:
+        if os.path.abspath(manifest['input_dir']) != os.path.abspath(input_dir):
+            raise ValueError("Job %s was created for %s" % (job_dir, manifest['input_dir']))
+        return manifest
+
+    from evaluate import list_images
+
+    files = [os.path.relpath(f, input_dir) for f in list_images(input_dir)]
+    manifest = {'input_dir': os.path.abspath(input_dir), 'created': time.time(),
+                'items': [{'path': f, 'key': item_key(f), 'output': stem} for f, stem in zip(files, output_stems(files))]}
+    for folder in (job_dir, os.path.join(job_dir, 'done'), os.path.join(job_dir, 'stats')):
+        if not os.path.exists(folder):
+            os.makedirs(folder, exist_ok=True)
+    # workers racing here build identical content, so whichever rename lands last is equivalent
+    atomic_write_json(os.path.join(job_dir, MANIFEST), manifest)
+    return manifest
+
+
+def done_keys(job_dir):
+    return set(name[:-len('.json')] for name in os.listdir(os.path.join(job_dir, 'done')) if name.endswith('.json'))
+
+
+def run_shard(args, manifest):
+    from inference import GeneratorSession
+    from image_io import AsyncImageWriter, ImageLoader
+
+    done = done_keys(args.job_dir)
+    items = [item for item in manifest['items']
+             if shard_of(item['key'], args.num_shards) == args.shard and item['key'] not in done]
+    shard_name = 'shard-%03d-of-%03d' % (args.shard, args.num_shards)
+    stats = {'shard': args.shard, 'num_shards': args.num_shards, 'host': platform.node(), 'pid': os.getpid(),
+             'assigned': len(items), 'processed': 0, 'pixels': 0, 'failed': [], 'start': time.time()}
+    print(" [*] %s: %d items to process" % (shard_name, len(items)))
+    if not items:
+        stats['end'] = stats['start']
+        return stats
+
+    # a failing item is recorded and skipped, and a failure of the worker itself still returns the stats so far
+    lock = threading.Lock()
+    generator, writer = None, None
+    stats['inference_time'] = 0.
+
+    def fail(item, e):
+        print(" [!] %s: %s failed (%s)" % (shard_name, item['path'], e))
+        with lock:
+            stats['failed'].append(item['path'])
+
+    def mark_done(item, pixels, seconds):
+        marker = {'path': item['path'], 'checkpoint': generator.path, 'seconds': seconds, 'host': platform.node()}
+        atomic_write_json(os.path.join(args.job_dir, 'done', item['key'] + '.json'), marker)
+        with lock:
+            stats['processed'] += 1
+            stats['pixels'] += pixels
+
+    try:
+        threads = args.threads or max(1, (os.cpu_count() or 1) // (args.num_shards if args.shard >= 0 else 1))
+        generator = GeneratorSession(args.checkpoint_dir, args.epoch, threads=threads)
+        print(" [*] %s: generator %s" % (shard_name, generator.path))
+        writer = AsyncImageWriter(fmt=args.out_format, quality=args.out_quality, save_real=bool(args.save_real))
+        loader = ImageLoader(args.img_size, args.max_side)
+
+        for i, item in enumerate(items):
+            try:
+                # the input buffer is reused by the next load, so the writer gets the 8 bit photo
+                sample_image, photo = loader.load(os.path.join(manifest['input_dir'], item['path']))
+
+                start_time = time.time()
+                generated = generator.run(sample_image)
+                seconds = time.time() - start_time
+                stats['inference_time'] += seconds
+
+                path_stem = os.path.join(args.output_dir, item.get('output', os.path.splitext(item['path'])[0]))
+                if not os.path.exists(os.path.dirname(path_stem)):
+                    os.makedirs(os.path.dirname(path_stem), exist_ok=True)
+                pixels = int(photo.shape[0] * photo.shape[1])
+                writer.submit(generated, photo, path_stem,
+                              on_done=lambda item=item, pixels=pixels, seconds=seconds: mark_done(item, pixels, seconds),
+                              on_error=lambda e, item=item: fail(item, e))
+            except Exception as e:
+                fail(item, e)
+            if (i + 1) % 50 == 0:
+                print(" [*] %s: %d / %d" % (shard_name, i + 1, len(items)))
+    except Exception as e:
+        print(" [!] %s: stopped (%s)" % (shard_name, e))
+        stats['error'] = str(e)
+    finally:
+        if writer is not None:
+            writer.close()
+        if generator is not None:
+            generator.close()
+        stats['end'] = time.time()
+    return stats
+
+
+def busy_seconds(runs):
+    # length of the union of the runs' [start, end] intervals, so idle gaps between a crash and a rerun are not counted
+    total, current_start, current_end = 0., None, None
+    for start, end in sorted((run['start'], run['end']) for run in runs):
+        if current_end is None or start > current_end:
+            if current_end is not None:
+                total += current_end - current_start
+            current_start, current_end = start, end
+        else:
+            current_end = max(current_end, end)
+    if current_end is not None:
+        total += current_end - current_start
+    return total
+
+
+def merge_stats(job_dir, manifest):
+    # combine every worker run into throughput totals and the progress of the whole job
+    total = len(manifest['items'])
+    stats_dir = os.path.join(job_dir, 'stats')
+    runs = []
+    for name in sorted(os.listdir(stats_dir)):
+        if name.endswith('.json'):
+            with open(os.path.join(stats_dir, name)) as f:
+                runs.append(json.load(f))
+
+    processed = sum(run['processed'] for run in runs)
+    busy = [run for run in runs if run['processed']]
+    wall = busy_seconds(busy)
+    done = done_keys(job_dir)
+    # an item that failed in one run and was finished by a later one is no longer failed
+    failed = sorted(set(f for run in runs for f in run['failed'] if item_key(f) not in done))
+    merged = {'items': total, 'done': len(done), 'runs': len(runs), 'processed': processed, 'failed': failed,
+              'wall_seconds': wall, 'images_per_second': processed / wall if wall else None,
+              'megapixels_per_second': sum(run['pixels'] for run in runs) / 1e6 / wall if wall else None,
+              'hosts': sorted(set(run['host'] for run in runs)),
+              'shards': [{'shard': run['shard'], 'host': run['host'], 'processed': run['processed'],
+                          'images_per_second': run['processed'] / (run['end'] - run['start'])
+                          if run['end'] > run['start'] else None} for run in busy]}
+    atomic_write_json(os.path.join(job_dir, 'stats.json'), merged)
+    return merged
+
+
+def spawn_local_shards(args):
+    # one process per shard on this host, each with its own TensorFlow session and a share of the CPUs
+    command = [sys.executable, os.path.abspath(__file__)]
+    for name, value in sorted(vars(args).items()):
+        if name in ('shard', 'merge') or value is None:
+            continue
+        command += ['--' + name] + ([str(v) for v in value] if isinstance(value, list) else [str(value)])
+    workers = [subprocess.Popen(command + ['--shard', str(shard)]) for shard in range(args.num_shards)]
+    return [worker.wait() for worker in workers]
+
+
+"""main"""
+def main():
+    args = parse_args()
+    if args is None:
+        exit(1)
+
+    if not args.merge:
+        manifest = build_manifest(args.job_dir, args.input_dir)
+
+        if args.shard < 0:
+            codes = spawn_local_shards(args)
+            if any(codes):
+                print(" [!] %d of %d shards failed; rerun to resume them" % (sum(1 for c in codes if c), len(codes)))
+        else:
+            stats = run_shard(args, manifest)
+            name = 'shard-%03d-of-%03d.%s.%d.json' % (args.shard, args.num_shards, platform.node(), int(stats['start']))
+            atomic_write_json(os.path.join(args.job_dir, 'stats', name), stats)
+            if stats['failed']:
+                print(" [!] %d items failed; rerun to retry them" % len(stats['failed']))
+            if 'error' in stats:
+                exit(1)
+            return
+
+    manifest = load_manifest(args.job_dir)
+    if manifest is None:
+        print(" [!] %s has no %s; start the job with --input_dir and --checkpoint_dir first" % (args.job_dir, MANIFEST))
+        exit(1)
+    merged = merge_stats(args.job_dir, manifest)
+    print(" [*] %d / %d items done, %d processed by %d runs on %d hosts" % (
+        merged['done'], merged['items'], merged['processed'], merged['runs'], len(merged['hosts'])))
+    if merged['images_per_second']:
+        print(" [*] %.2f images/s, %.2f megapixels/s over %.1f s" % (
+            merged['images_per_second'], merged['megapixels_per_second'], merged['wall_seconds']))
+    print("Statistics are saved in " + os.path.join(args.job_dir, 'stats.json'))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,660 @@
+"""Benchmarks for the training and inference hot paths.
+
+Everything runs on synthetic data with randomly initialised weights inside a
+throw-away working directory, so neither the dataset nor a checkpoint nor the
+real VGG19 weights are needed. Results are written as JSON and can be compared
+against a saved baseline to flag regressions.
+"""
+import argparse
+import json
+import os
+import platform
+import shutil
+import sys
+import tempfile
+import time
+from argparse import Namespace
+
+import numpy as np
+
+REPO_DIR = os.path.dirname(os.path.abspath(__file__))
+
+# conv layers read by tools.vgg19.Vgg19.build (fc layers are never built for the losses)
+VGG19_LAYERS = [('conv1_1', 3, 64), ('conv1_2', 64, 64),
+                ('conv2_1', 64, 128), ('conv2_2', 128, 128),
+                ('conv3_1', 128, 256), ('conv3_2', 256, 256), ('conv3_3', 256, 256), ('conv3_4', 256, 256),
+                ('conv4_1', 256, 512), ('conv4_2', 512, 512), ('conv4_3', 512, 512), ('conv4_4', 512, 512),
+                ('conv5_1', 512, 512), ('conv5_2', 512, 512), ('conv5_3', 512, 512), ('conv5_4', 512, 512)]
+
+BENCHMARKS = []
+
+
+def benchmark(func):
+    BENCHMARKS.append(func)
+    return func
+
+
+"""parsing and configuration"""
+
+def parse_args():
+    desc = "AnimeStyle benchmarks"
+    parser = argparse.ArgumentParser(description=desc)
+
+    parser.add_argument('--only', type=str, default='', help='comma separated substrings; run only matching benchmarks')
+    parser.add_argument('--batch_size', type=int, default=4, help='batch size used by the train step benchmarks')
+    parser.add_argument('--resolutions', type=str, default='256,512,1024', help='square sizes for generator inference')
+    parser.add_argument('--batch_sizes', type=str, default='1,4', help='batch sizes for generator inference')
+    parser.add_argument('--warmup', type=int, default=2, help='untimed runs before measuring')
+    parser.add_argument('--repeat', type=int, default=10, help='timed runs per benchmark')
+    parser.add_argument('--seed', type=int, default=0, help='seed for synthetic data and weights')
+    parser.add_argument('--startup_repeat', type=int, default=3, help='fresh interpreter launches per startup benchmark')
+    parser.add_argument('--threads', type=int, default=8, help='intra/inter op parallelism threads')
+
+    parser.add_argument('--output', type=str, default='bench_results.json', help='where to write this run')
+    parser.add_argument('--baseline', type=str, default='bench_baseline.json', help='baseline to compare against')
+    parser.add_argument('--save_baseline', action='store_true', help='overwrite the baseline with this run')
+    parser.add_argument('--tolerance', type=float, default=0.10, help='allowed slowdown ratio before flagging a regression')
+
+    return parser.parse_args()
+
+
+"""measurement"""
+
+def summarize(times):
+    times = np.asarray(times)
+    return {'median': float(np.median(times)), 'mean': float(times.mean()),
+            'min': float(times.min()), 'std': float(times.std()), 'repeat': int(len(times))}
+
+
+def measure(fn, warmup, repeat):
+    for _ in range(warmup):
+        fn()
+    times = []
+    for _ in range(repeat):
+        start_time = time.perf_counter()
+        fn()
+        times.append(time.perf_counter() - start_time)
+    return summarize(times)
+
+
+def session_config(args):
+    import tensorflow as tf
+    return tf.ConfigProto(allow_soft_placement=True, inter_op_parallelism_threads=args.threads,
+                          intra_op_parallelism_threads=args.threads)
+
+
+def model_args(args, **overrides):
+    # mirrors the defaults of main.parse_args
+    config = Namespace(phase='train', dataset='BENCH', g_adv_weight=300.0, d_adv_weight=300.0, con_weight=1.5,
+                       color_weight=15., tv_weight=1.0, epoch=2, init_epoch=1, batch_size=args.batch_size, accum_steps=1,
+                       save_freq=1, init_lr=2e-4, g_lr=2e-5, d_lr=1e-5, img_size=[256, 256], img_ch=3, sn=True,
+                       val_freq=1, val_mode='sync', val_device='', val_fid=False,
+                       fid_size=224, fid_cache='fid_cache', checkpoint_dir='checkpoint', init_checkpoint_dir='init_checkpoint',
+                       result_dir='results', sample_dir='samples', video_batch=4, video_reuse_threshold=1.5,
+                       video_max_side=0, out_format='jpg', out_quality=95, save_real=True, writer_threads=2,
+                       max_side=0, backend='tf', mem_report='', mem_budget=0., gpu_mem_budget=0.,
+                       latency_budget=0., cost_model='', student_ch=16, student_blocks=4,
+                       distill_epoch=1, distill_lr=2e-4, distill_con_weight=0., distill_color_weight=0., teacher_epoch=0)
+    for key, value in overrides.items():
+        setattr(config, key, value)
+    return config
+
+
+"""synthetic workspace"""
+
+def synthetic_image(rng, h, w):
+    # smooth colour gradients plus noise, so JPEG encoding and brightness matching see realistic content
+    yy, xx = np.mgrid[0:h, 0:w].astype(np.float32)
+    base = np.stack([xx / w, yy / h, (xx + yy) / (w + h)], axis=-1) * 200.
+    noise = rng.normal(0, 20, size=(h, w, 3))
+    return np.clip(base + noise, 0, 255).astype(np.uint8)
+
+
+def make_workspace(args, rng):
+    import cv2
+
+    work_dir = tempfile.mkdtemp(prefix='animestyle_bench_')
+    for sub, count, size in [('train_photo', 4 * args.batch_size, 256), ('BENCH', 4 * args.batch_size, 256),
+                             ('val', 2, 512), ('test', 2, 512)]:
+        folder = os.path.join(work_dir, 'dataset', sub)
+        os.makedirs(folder)
+        for i in range(count):
+            cv2.imwrite(os.path.join(folder, '%03d.jpg' % i), synthetic_image(rng, size, size))
+
+    vgg_dir = os.path.join(work_dir, 'vgg19_weight')
+    os.makedirs(vgg_dir)
+    weights = {}
+    for name, c_in, c_out in VGG19_LAYERS:
+        weights[name] = [rng.normal(0, np.sqrt(2. / (9 * c_in)), size=(3, 3, c_in, c_out)).astype(np.float32),
+                         np.zeros(c_out, np.float32)]
+    np.save(os.path.join(vgg_dir, 'vgg19.npy'), weights)
+    return work_dir
+
+
+"""benchmarks"""
+
+@benchmark
+def generator_inference(args, rng):
+    import tensorflow as tf
+    from net.generator import G_net_unet
+
+    results = {}
+    graph = tf.Graph()
+    with graph.as_default():
+        tf.set_random_seed(args.seed)
+        test_real = tf.placeholder(tf.float32, [None, None, None, 3], name='test_input')
+        with tf.variable_scope('generator'):
+            test_generated = G_net_unet(test_real)
+        with tf.Session(config=session_config(args)) as sess:
+            sess.run(tf.global_variables_initializer())
+            for size in [int(s) for s in args.resolutions.split(',')]:
+                for batch in [int(b) for b in args.batch_sizes.split(',')]:
+                    sample = rng.uniform(-1, 1, size=(batch, size, size, 3)).astype(np.float32)
+                    results['generator_inference/%dx%d/b%d' % (size, size, batch)] = measure(
+                        lambda: sess.run(test_generated, feed_dict={test_real: sample}), args.warmup, args.repeat)
+    return results
+
+
+@benchmark
+def student_inference(args, rng):
+    import tensorflow as tf
+    from net.student import G_net_student
+
+    results = {}
+    graph = tf.Graph()
+    with graph.as_default():
+        tf.set_random_seed(args.seed)
+        test_real = tf.placeholder(tf.float32, [None, None, None, 3], name='test_input')
+        with tf.variable_scope('student'):
+            test_generated = G_net_student(test_real)
+        with tf.Session(config=session_config(args)) as sess:
+            sess.run(tf.global_variables_initializer())
+            for size in [int(s) for s in args.resolutions.split(',')]:
+                sample = rng.uniform(-1, 1, size=(1, size, size, 3)).astype(np.float32)
+                results['student_inference/%dx%d/b1' % (size, size)] = measure(
+                    lambda: sess.run(test_generated, feed_dict={test_real: sample}), args.warmup, args.repeat)
+    return results
+
+
+def random_batches(model, rng):
+    shape = [model.micro_batch_size] + model.img_size + [model.img_ch]
+    return [(rng.uniform(-1, 1, size=shape).astype(np.float32), rng.uniform(-1, 1, size=shape).astype(np.float32))
+            for _ in range(model.accum_steps)]
+
+
+@benchmark
+def train_step(args, rng):
+    import tensorflow as tf
+    from model import AnimeStyle
+
+    results = {}
+    graph = tf.Graph()
+    with graph.as_default():
+        tf.set_random_seed(args.seed)
+        with tf.Session(config=session_config(args)) as sess:
+            model = AnimeStyle(sess, model_args(args))
+            model.build_model()
+            sess.run(tf.global_variables_initializer())
+            sess.run(tf.local_variables_initializer())
+
+            batches = random_batches(model, rng)
+            results['train_step/init'] = measure(lambda: model.init_step(batches), args.warmup, args.repeat)
+            results['train_step/gan'] = measure(lambda: model.gan_step(batches), args.warmup, args.repeat)
+    return results
+
+
+@benchmark
+def progressive_train_step(args, rng):
+    # GAN step cost at the lower resolutions of a progressive schedule (256 is covered by train_step)
+    import tensorflow as tf
+    from model import AnimeStyle
+
+    results = {}
+    for size in [128, 192]:
+        graph = tf.Graph()
+        with graph.as_default():
+            tf.set_random_seed(args.seed)
+            with tf.Session(config=session_config(args)) as sess:
+                model = AnimeStyle(sess, model_args(args, img_size=[size, size]))
+                model.build_model()
+                sess.run(tf.global_variables_initializer())
+                batches = random_batches(model, rng)
+                results['progressive_train_step/gan/%d' % size] = measure(
+                    lambda: model.gan_step(batches), args.warmup, args.repeat)
+    return results
+
+
+ACCUMULATION_SCRIPT = """
+import json, resource, sys, time
+import numpy as np
+import tensorflow as tf
+from argparse import Namespace
+from model import AnimeStyle
+import benchmark
+
+args = Namespace(batch_size=int(sys.argv[1]), warmup=int(sys.argv[3]), repeat=int(sys.argv[4]))
+with tf.Session(config=tf.ConfigProto(allow_soft_placement=True)) as sess:
+    model = AnimeStyle(sess, benchmark.model_args(args, accum_steps=int(sys.argv[2])))
+    model.build_model()
+    sess.run(tf.global_variables_initializer())
+    sess.run(tf.local_variables_initializer())
+    batches = benchmark.random_batches(model, np.random.RandomState(0))
+    timings = benchmark.measure(lambda: model.gan_step(batches), args.warmup, args.repeat)
+    timings['peak_rss_mb'] = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024.
+    if tf.test.is_gpu_available():
+        timings['peak_gpu_mb'] = sess.run(tf.contrib.memory_stats.MaxBytesInUse()) / 1024. ** 2
+print(json.dumps(timings))
+"""
+
+
+@benchmark
+def accumulation(args, rng):
+    # each configuration runs in a fresh process so its peak memory is not hidden by the previous one
+    import subprocess
+
+    env = dict(os.environ, PYTHONPATH=REPO_DIR + os.pathsep + os.environ.get('PYTHONPATH', ''))
+    results = {}
+    accum_steps = 1
+    while accum_steps <= args.batch_size:
+        if args.batch_size % accum_steps == 0:
+            out = subprocess.run([sys.executable, '-c', ACCUMULATION_SCRIPT, str(args.batch_size), str(accum_steps),
+                                  str(args.warmup), str(max(1, args.repeat // 2))], env=env,
+                                 stdout=subprocess.PIPE, check=True, universal_newlines=True).stdout
+            name = 'accumulation/b%d_x%d' % (args.batch_size, accum_steps)
+            results[name] = json.loads(out.strip().splitlines()[-1])
+            print(" [*] %s: %.1f ms per logical GAN step, peak RSS %.1f MB%s" % (
+                name, results[name]['median'] * 1e3, results[name]['peak_rss_mb'],
+                ', peak GPU %.1f MB' % results[name]['peak_gpu_mb'] if 'peak_gpu_mb' in results[name] else ''))
+        accum_steps *= 2
+    return results
+
+
+@benchmark
+def patch_extraction(args, rng):
+    import tensorflow as tf
+    from tools.patch_extractor import extract_top_k_img_patches_by_sum
+
+    graph = tf.Graph()
+    with graph.as_default():
+        images = tf.placeholder(tf.float32, [args.batch_size, 256, 256, 3])
+        patches = extract_top_k_img_patches_by_sum(images, 96, 48, args.batch_size * 4)
+        sample = rng.uniform(-1, 1, size=(args.batch_size, 256, 256, 3)).astype(np.float32)
+        with tf.Session(config=session_config(args)) as sess:
+            return {'patch_extraction/b%d' % args.batch_size: measure(
+                lambda: sess.run(patches, feed_dict={images: sample}), args.warmup, args.repeat)}
+
+
+@benchmark
+def data_loading(args, rng):
+    import tensorflow as tf
+    from tools.data_loader import ImageGenerator
+    from tools.utils import load_test_data
+
+    results = {}
+    graph = tf.Graph()
+    with graph.as_default():
+        image_generator = ImageGenerator('./dataset/train_photo', args.batch_size)
+        img_op = image_generator.load_images()
+        with tf.Session(config=session_config(args)) as sess:
+            results['data_loading/train_batch/b%d' % args.batch_size] = measure(
+                lambda: sess.run(img_op), args.warmup, args.repeat)
+
+    sample_file = os.path.join('dataset', 'test', '000.jpg')
+    results['data_loading/test_image'] = measure(
+        lambda: load_test_data(sample_file, [256, 256]), args.warmup, args.repeat)
+    return results
+
+
+@benchmark
+def large_photo_loading(args, rng):
+    # tools.utils.load_test_data against image_io.ImageLoader on a 12 MP and a 24 MP JPEG
+    import cv2
+    from tools.utils import load_test_data
+    from image_io import ImageLoader
+    from inference import working_size
+
+    results = {}
+    for name, (h, w) in [('12mp', (3000, 4000)), ('24mp', (4000, 6000))]:
+        # smooth content with mild noise compresses and decodes like a photo, unlike pure noise
+        y, x = np.mgrid[0:h, 0:w].astype(np.float32)
+        img = np.stack([127 + 100 * np.sin(x / 300.), 127 + 100 * np.cos(y / 200.), 127 + 60 * np.sin((x + y) / 500.)], -1)
+        img += rng.normal(0, 6, size=(h, w, 3)).astype(np.float32)
+        sample_file = os.path.join('dataset', 'large_%s.jpg' % name)
+        cv2.imwrite(sample_file, np.clip(img, 0, 255).astype(np.uint8), [cv2.IMWRITE_JPEG_QUALITY, 92])
+        del img, x, y
+
+        results['large_photo_loading/%s/before' % name] = measure(
+            lambda: load_test_data(sample_file, [256, 256]), 1, args.repeat)
+        loader = ImageLoader([256, 256])
+        results['large_photo_loading/%s/after' % name] = measure(lambda: loader.load(sample_file), 1, args.repeat)
+
+        # capped at 1024: full decode then resize, as before, against the scaled JPEG decode
+        def full_decode_capped():
+            image = load_test_data(sample_file, [256, 256])[0]
+            ch, cw = working_size(image.shape[0], image.shape[1], [256, 256], 1024)
+            return cv2.resize(image, (cw, ch), interpolation=cv2.INTER_AREA)
+
+        results['large_photo_loading/%s/max_side_1024/before' % name] = measure(full_decode_capped, 1, args.repeat)
+        capped_loader = ImageLoader([256, 256], 1024)
+        results['large_photo_loading/%s/max_side_1024/after' % name] = measure(
+            lambda: capped_loader.load(sample_file), 1, args.repeat)
+        os.remove(sample_file)
+    return results
+
+
+@benchmark
+def image_save(args, rng):
+    from tools.utils import save_images
+
+    sample_file = os.path.join('dataset', 'test', '000.jpg')
+    generated = rng.uniform(-1, 1, size=(1, 512, 512, 3)).astype(np.float32)
+    out_dir = os.path.join('results', 'bench')
+    os.makedirs(out_dir, exist_ok=True)
+    return {
+        'image_save/plain': measure(
+            lambda: save_images(generated, 'BENCH', os.path.join(out_dir, 'a.jpg'), None), args.warmup, args.repeat),
+        'image_save/brightness_matched': measure(
+            lambda: save_images(generated, 'BENCH', os.path.join(out_dir, 'b.jpg'), sample_file), args.warmup, args.repeat),
+    }
+
+
+@benchmark
+def video(args, rng):
+    import cv2
+    import tensorflow as tf
+    from net.generator import G_net_unet
+    from video import VideoCartoonizer
+
+    # a short clip with static stretches, so frame reuse has something to skip
+    video_path = os.path.join('dataset', 'clip.mp4')
+    writer = cv2.VideoWriter(video_path, cv2.VideoWriter_fourcc(*'mp4v'), 25., (480, 272))
+    frame = synthetic_image(rng, 272, 480)
+    for i in range(48):
+        if i % 8 == 0:
+            frame = synthetic_image(rng, 272, 480)
+        writer.write(frame)
+    writer.release()
+
+    results = {}
+    graph = tf.Graph()
+    with graph.as_default():
+        test_real = tf.placeholder(tf.float32, [None, None, None, 3], name='test_input')
+        with tf.variable_scope('generator'):
+            test_generated = G_net_unet(test_real)
+        with tf.Session(config=session_config(args)) as sess:
+            sess.run(tf.global_variables_initializer())
+            infer_fn = lambda batch: sess.run(test_generated, feed_dict={test_real: batch})
+            for name, threshold in [('no_reuse', 0.), ('reuse', 1.5)]:
+                cartoonizer = VideoCartoonizer(infer_fn, [256, 256], batch_size=4, reuse_threshold=threshold)
+                stats = []
+                results['video/%s' % name] = measure(
+                    lambda: stats.append(cartoonizer.run(video_path, os.path.join('results', 'clip.mp4'))),
+                    0, max(1, args.repeat // 5))
+                results['video/%s' % name]['fps'] = stats[-1]['fps']
+    return results
+
+
+@benchmark
+def guided_upsampling(args, rng):
+    from adaptive import guided_upsample
+
+    guide = synthetic_image(rng, 1536, 2048).astype(np.float32) / 255.
+    low_out = rng.uniform(0, 1, size=(384, 512, 3)).astype(np.float32)
+    return {'guided_upsampling/512to2048': measure(lambda: guided_upsample(low_out, guide), args.warmup, args.repeat)}
+
+
+@benchmark
+def fid_evaluation(args, rng):
+    from evaluate import FeatureExtractor, reference_stats, distance
+
+    extractor = FeatureExtractor(224, 16, threads=args.threads)
+    cache_dir = os.path.join('results', 'fid_cache')
+    generated = [rng.uniform(-1, 1, size=(256, 256, 3)).astype(np.float32) for _ in range(16)]
+    results = {
+        'fid_evaluation/reference_uncached': measure(
+            lambda: (shutil.rmtree(cache_dir, ignore_errors=True), reference_stats(extractor, './dataset/BENCH', cache_dir)),
+            0, max(1, args.repeat // 5)),
+        'fid_evaluation/reference_cached': measure(
+            lambda: reference_stats(extractor, './dataset/BENCH', cache_dir), args.warmup, args.repeat),
+    }
+    reference = reference_stats(extractor, './dataset/BENCH', cache_dir)
+    results['fid_evaluation/generated_16'] = measure(
+        lambda: distance(extractor(generated), reference), args.warmup, args.repeat)
+    extractor.close()
+    return results
+
+
+@benchmark
+def async_image_save(args, rng):
+    # the writer path used by test_files; submit time is what the inference loop waits for
+    from image_io import AsyncImageWriter
+
+    real = rng.uniform(-1, 1, size=(1, 512, 512, 3)).astype(np.float32)
+    generated = rng.uniform(-1, 1, size=(1, 512, 512, 3)).astype(np.float32)
+    out_dir = os.path.join('results', 'bench_async')
+    os.makedirs(out_dir, exist_ok=True)
+    writer = AsyncImageWriter()
+    results = {'async_image_save/submit': measure(
+        lambda: writer.submit(generated, real, os.path.join(out_dir, 'img')), args.warmup, args.repeat)}
+    writer.close()
+
+    def write_batch():
+        batch_writer = AsyncImageWriter()
+        for i in range(8):
+            batch_writer.submit(generated, real, os.path.join(out_dir, 'img%d' % i))
+        batch_writer.close()
+
+    results['async_image_save/8_images'] = measure(write_batch, args.warmup, args.repeat)
+    return results
+
+
+def random_checkpoint(args):
+    # a generator checkpoint with random weights, for the tools that restore one
+    import tensorflow as tf
+    from net.generator import G_net_unet
+
+    checkpoint_dir = os.path.join('checkpoint', 'bench_generator')
+    if tf.train.get_checkpoint_state(checkpoint_dir):
+        return checkpoint_dir
+    os.makedirs(checkpoint_dir, exist_ok=True)
+    graph = tf.Graph()
+    with graph.as_default():
+        tf.set_random_seed(args.seed)
+        test_real = tf.placeholder(tf.float32, [None, None, None, 3], name='test_input')
+        with tf.variable_scope('generator'):
+            G_net_unet(test_real)
+        with tf.Session(config=session_config(args)) as sess:
+            sess.run(tf.global_variables_initializer())
+            tf.train.Saver().save(sess, os.path.join(checkpoint_dir, 'AnimeStyle.model'), global_step=1)
+    return checkpoint_dir
+
+
+@benchmark
+def backends(args, rng):
+    # the same generator checkpoint (random weights) served by each inference backend that is installed
+    from backends import BACKENDS, create_backend
+
+    checkpoint_dir = random_checkpoint(args)
+    results = {}
+    for name in BACKENDS:
+        try:
+            backend = create_backend(name, checkpoint_dir, threads=args.threads)
+        except ImportError as e:
+            print(" [!] Skipping the %s backend: %s" % (name, e))
+            continue
+        for size in [int(s) for s in args.resolutions.split(',')]:
+            for batch_size in [int(b) for b in args.batch_sizes.split(',')]:
+                sample = rng.uniform(-1, 1, size=(batch_size, size, size, 3)).astype(np.float32)
+                results['backends/%s/%dx%d/b%d' % (name, size, size, batch_size)] = measure(
+                    lambda: backend.run(sample), args.warmup, args.repeat)
+        backend.close()
+    return results
+
+
+@benchmark
+def incremental_render(args, rng):
+    # UI re-render of a 1024x1024 photo: full run against a 64x64 retouch and a crop of the cached input
+    from inference import GeneratorSession
+    from incremental import IncrementalRenderer
+
+    generator = GeneratorSession(random_checkpoint(args), threads=args.threads)
+    renderer = IncrementalRenderer(generator, max_side=1024)
+    photo = rng.randint(0, 256, size=(1024, 1024, 3)).astype(np.uint8)
+    edited = photo.copy()
+    edited[480:544, 480:544] = 255 - edited[480:544, 480:544]
+
+    def full():
+        renderer.invalidate()
+        renderer.render(photo)
+
+    results = {'incremental_render/full': measure(full, args.warmup, args.repeat)}
+    cached = (renderer.input, renderer.output, renderer.scale)
+
+    def from_cache(image):
+        # every run starts from the cache of the full render
+        renderer.input, renderer.output, renderer.scale = cached
+        renderer.render(image)
+
+    retouch = lambda: from_cache(edited)
+    crop = lambda: from_cache(photo[128:896, 64:960])
+    results['incremental_render/retouch_64'] = measure(retouch, args.warmup, args.repeat)
+    results['incremental_render/crop'] = measure(crop, args.warmup, args.repeat)
+    generator.close()
+    return results
+
+
+# modules only the training graph needs; the test phase must not import any of them
+TRAINING_ONLY_MODULES = ['net.discriminator', 'tools.data_loader', 'tools.vgg19', 'tools.patch_extractor']
+
+STARTUP_SCRIPT = """
+import json, sys, time
+start_time = time.perf_counter()
+sys.argv = ['main.py', '--phase', sys.argv[1], '--dataset', 'BENCH', '--batch_size', sys.argv[2]]
+import main
+args = main.parse_args()
+args_time = time.perf_counter()
+import tensorflow as tf
+from model import AnimeStyle
+import_time = time.perf_counter()
+with tf.Session() as sess:
+    model = AnimeStyle(sess, args)
+    model.build_model()
+build_time = time.perf_counter()
+print(json.dumps({'args': args_time - start_time, 'import': import_time - args_time, 'build': build_time - import_time,
+                  'modules': [m for m in sys.modules if m in %r]}))
+""" % TRAINING_ONLY_MODULES
+
+
+@benchmark
+def startup(args, rng):
+    import subprocess
+
+    env = dict(os.environ, PYTHONPATH=REPO_DIR + os.pathsep + os.environ.get('PYTHONPATH', ''))
+    results = {}
+
+    # argument parsing alone, as seen by a user typing --help
+    times = []
+    for _ in range(args.startup_repeat):
+        start_time = time.perf_counter()
+        subprocess.run([sys.executable, os.path.join(REPO_DIR, 'main.py'), '--help'],
+                       stdout=subprocess.DEVNULL, check=True)
+        times.append(time.perf_counter() - start_time)
+    results['startup/help'] = summarize(times)
+
+    # per phase: parse/validate arguments, import TensorFlow and the model, build the graph
+    for phase in ['test', 'train']:
+        stages = {'args': [], 'import': [], 'build': []}
+        for _ in range(args.startup_repeat):
+            out = subprocess.run([sys.executable, '-c', STARTUP_SCRIPT, phase, str(args.batch_size)], env=env,
+                                 stdout=subprocess.PIPE, check=True, universal_newlines=True).stdout
+            timings = json.loads(out.strip().splitlines()[-1])
+            for stage in stages:
+                stages[stage].append(timings[stage])
+            if phase == 'test' and timings['modules']:
+                print(" [!] test phase imported training-only modules: " + ', '.join(timings['modules']))
+        for stage, times in stages.items():
+            results['startup/%s/%s' % (phase, stage)] = summarize(times)
+    return results
+
+
+"""baseline comparison"""
+
+def compare(results, baseline, tolerance):
+    regressions = []
+    for name in sorted(results):
+        current = results[name]['median']
+        if name not in baseline:
+            print(" [*] %-45s %10.2f ms  (new)" % (name, current * 1e3))
+            continue
+        reference = baseline[name]['median']
+        ratio = current / reference if reference > 0 else float('inf')
+        flag = ''
+        if ratio > 1. + tolerance:
+            flag = '  REGRESSION'
+            regressions.append(name)
+        elif ratio < 1. - tolerance:
+            flag = '  improved'
+        print(" [*] %-45s %10.2f ms  baseline %10.2f ms  x%.2f%s" % (name, current * 1e3, reference * 1e3, ratio, flag))
+    return regressions
+
+
+def host_info():
+    return {'host': platform.node(), 'machine': platform.machine(), 'python': platform.python_version(),
+            'processor': platform.processor(), 'cpu_count': os.cpu_count()}
+
+
+"""main"""
+def main():
+    args = parse_args()
+    only = [s for s in args.only.split(',') if s]
+
+    output_path = os.path.abspath(args.output)
+    baseline_path = os.path.abspath(args.baseline)
+
+    rng = np.random.RandomState(args.seed)
+    work_dir = make_workspace(args, rng)
+    cwd = os.getcwd()
+    sys.path.insert(0, REPO_DIR)
+    os.chdir(work_dir)
+
+    results = {}
+    try:
+        for func in BENCHMARKS:
+            if only and not any(s in func.__name__ for s in only):
+                continue
+            print(" [*] Running %s ..." % func.__name__)
+            results.update(func(args, np.random.RandomState(args.seed)))
+    finally:
+        os.chdir(cwd)
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+    report = {'host': host_info(), 'created': time.strftime('%Y-%m-%d %H:%M:%S'), 'results': results}
+    with open(output_path, 'w') as f:
+        json.dump(report, f, indent=2, sort_keys=True)
+    print(" [*] Results written to " + output_path)
+
+    if args.save_baseline:
+        with open(baseline_path, 'w') as f:
+            json.dump(report, f, indent=2, sort_keys=True)
+        print(" [*] Baseline saved to " + baseline_path)
+        return
+
+    if not os.path.exists(baseline_path):
+        compare(results, {}, args.tolerance)
+        print(" [!] No baseline found at {}, run with --save_baseline to create one".format(baseline_path))
+        return
+
+    with open(baseline_path) as f:
+        baseline = json.load(f)
+    if baseline.get('host', {}).get('host') != report['host']['host']:
+        print(" [!] Baseline was recorded on a different host, timings may not be comparable")
+
+    regressions = compare(results, baseline['results'], args.tolerance)
+    if regressions:
+        print(" [!] %d regression(s): %s" % (len(regressions), ', '.join(regressions)))
+        sys.exit(1)
+    print(" [*] No regressions")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,145 @@
+"""Live camera capture and frame-rate driven resolution control.
+
+CameraCapture reads frames on a background thread and keeps only the newest
+one, so a slow consumer never works on a stale backlog. A video file can be
+given instead of a device index; it is then paced at its own frame rate and
+looped, which makes it a reproducible stand-in for a real camera.
+ResolutionController picks the processing scale that keeps the generator
+close to a target frame rate.
+"""
+import threading
+import time
+
+import cv2
+import numpy as np
+
+
+def parse_source(source):
+    # "0", "1", ... are device indices, anything else is a file or stream URL
+    return int(source) if str(source).isdigit() else source
+
+
+class CameraCapture(object):
+
+    def __init__(self, source=0, max_failures=5):
+        self.source = parse_source(source)
+        self.is_file = not isinstance(self.source, int)
+        self.capture = cv2.VideoCapture(self.source)
+        if not self.capture.isOpened():
+            raise IOError("Could not open camera source {}".format(source))
+        self.fps = self.capture.get(cv2.CAP_PROP_FPS) or 30.
+
+        self._lock = threading.Lock()
+        self._frame = None
+        self._frame_id = 0
+        self._frame_time = 0.
+        self._consumed_id = 0
+        # frames replaced before the consumer took them
+        self.dropped = 0
+        # reason the capture stopped on its own, None while running or after stop()
+        self.error = None
+        self.max_failures = max_failures
+        self._running = False
+        self._thread = None
+
+
+    def start(self):
+        self._running = True
+        self._thread = threading.Thread(target=self._loop, daemon=True)
+        self._thread.start()
+        return self
+
+
+    def _loop(self):
+        interval = 1. / self.fps
+        next_time = time.time()
+        failures = 0
+        while self._running:
+            ret, frame = self.capture.read()
+            if not ret:
+                # a device may fail a few reads while it warms up, and a file is looped; a source that still
+                # yields no frame after max_failures retries (rewinding a file) is gone, empty or unreadable
+                failures += 1
+                if failures > self.max_failures:
+                    self.error = "No frame could be read from {} ({} attempts)".format(self.source, failures)
+                    break
+                if self.is_file:
+                    self.capture.set(cv2.CAP_PROP_POS_FRAMES, 0)
+                time.sleep(min(0.5, 0.01 * 2 ** failures))
+                continue
+            failures = 0
+            if self.is_file:
+                # emulate a live source: deliver frames at the recorded rate
+                next_time += interval
+                delay = next_time - time.time()
+                if delay > 0:
+                    time.sleep(delay)
+                else:
+                    next_time = time.time()
+            with self._lock:
+                if self._frame is not None and self._frame_id != self._consumed_id:
+                    self.dropped += 1
+                self._frame = frame
+                self._frame_id += 1
+                self._frame_time = time.time()
+        self._running = False
+
+
+    def latest(self, after_id=0):
+        # newest frame newer than after_id as (frame_id, frame, capture_time), or None
+        with self._lock:
+            if self._frame is None or self._frame_id <= after_id:
+                return None
+            self._consumed_id = self._frame_id
+            return self._frame_id, self._frame, self._frame_time
+
+
+    @property
+    def running(self):
+        return self._running
+
+
+    def stop(self):
+        self._running = False
+        if self._thread is not None:
+            self._thread.join(timeout=1.)
+        self.capture.release()
+
+
+class ResolutionController(object):
+
+    def __init__(self, target_fps=15., min_scale=0.2, max_scale=1.0, smoothing=0.3, align=32, min_side=64):
+        self.target_time = 1. / target_fps
+        self.min_scale = min_scale
+        self.max_scale = max_scale
+        self.smoothing = smoothing
+        self.align = align
+        self.min_side = min_side
+        self.scale = 0.5
+        self.mean_time = None
+
+
+    def size(self, h, w):
+        # processing (h, w) for a frame, aligned for the generator
+        def fit(x):
+            return max(self.min_side, int(x * self.scale) // self.align * self.align)
+        return fit(h), fit(w)
+
+
+    def update(self, inference_time):
+        # generator cost grows with the pixel count, so correct the scale by the square root of the time ratio
+        if self.mean_time is None:
+            self.mean_time = inference_time
+        else:
+            self.mean_time = (1. - self.smoothing) * self.mean_time + self.smoothing * inference_time
+        wanted = self.scale * np.sqrt(self.target_time / max(self.mean_time, 1e-6))
+        self.scale = float(np.clip(self.scale + self.smoothing * (wanted - self.scale), self.min_scale, self.max_scale))
+        return self.scale
+
+
+def draw_overlay(frame_bgr, fps, latency, size, dropped=0):
+    # dropped: camera frames replaced before the generator could take them
+    text = "%.1f FPS  %d ms  %dx%d  %d dropped" % (fps, latency * 1e3, size[1], size[0], dropped)
+    cv2.putText(frame_bgr, text, (10, 25), cv2.FONT_HERSHEY_SIMPLEX, 0.6, (0, 0, 0), 3, cv2.LINE_AA)
+    cv2.putText(frame_bgr, text, (10, 25), cv2.FONT_HERSHEY_SIMPLEX, 0.6, (255, 255, 255), 1, cv2.LINE_AA)
+    return frame_bgr
@@ -0,0 +1,134 @@
+"""Distribution distance (FID/KID) between generated images and an anime dataset.
+
+Features are the spatially averaged conv4_4 responses of tools.vgg19.Vgg19,
+the same layer the content loss uses. Reference statistics of a dataset are
+computed once and cached on disk, keyed by the file list, so ranking many
+checkpoints only costs the generated-side features.
+"""
+import hashlib
+import os
+from glob import glob
+
+import cv2
+import numpy as np
+
+IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png', '.bmp', '.webp')
+
+
+def list_images(folder):
+    files = glob(os.path.join(folder, '**', '*.*'), recursive=True)
+    return sorted(f for f in files if f.lower().endswith(IMAGE_EXTENSIONS))
+
+
+class FeatureExtractor(object):
+
+    def __init__(self, size=224, batch_size=16, threads=4):
+        import tensorflow as tf
+        from tools.vgg19 import Vgg19
+
+        self.size = size
+        self.batch_size = batch_size
+        self.graph = tf.Graph()
+        with self.graph.as_default():
+            self.images = tf.placeholder(tf.float32, [None, size, size, 3], name='fid_input')
+            vgg = Vgg19()
+            vgg.build(self.images)
+            self.features = tf.reduce_mean(vgg.conv4_4_no_activation, axis=[1, 2])
+            self.sess = tf.Session(config=tf.ConfigProto(inter_op_parallelism_threads=threads,
+                                                         intra_op_parallelism_threads=threads))
+            self.sess.run(tf.global_variables_initializer())
+
+
+    def prepare(self, image):
+        # float [h, w, 3] in [-1, 1] (or [1, h, w, 3]) -> float [size, size, 3]
+        if image.ndim == 4:
+            image = image[0]
+        return cv2.resize(image, (self.size, self.size), interpolation=cv2.INTER_AREA)
+
+
+    def __call__(self, images):
+        # images: iterable of float arrays in [-1, 1] of any size; returns [n, 512] features
+        features, batch = [], []
+        for image in images:
+            batch.append(self.prepare(image))
+            if len(batch) == self.batch_size:
+                features.append(self.sess.run(self.features, feed_dict={self.images: np.stack(batch)}))
+                batch = []
+        if batch:
+            features.append(self.sess.run(self.features, feed_dict={self.images: np.stack(batch)}))
+        return np.concatenate(features, axis=0).astype(np.float64) if features else np.zeros((0, 512))
+
+
+    def close(self):
+        self.sess.close()
+
+
+def read_image(path):
+    img = cv2.cvtColor(cv2.imread(path), cv2.COLOR_BGR2RGB)
+    return img.astype(np.float32) / 127.5 - 1.0
+
+
+def reference_stats(extractor, dataset_dir, cache_dir='fid_cache', max_kid_features=2000):
+    # mean/covariance of the dataset features, plus a feature subset for KID, cached per file list
+    files = list_images(dataset_dir)
+    if not files:
+        raise IOError("No images found in " + dataset_dir)
+
+    key = hashlib.sha1()
+    key.update(str(extractor.size).encode())
+    for f in files:
+        stat = os.stat(f)
+        key.update(('%s|%d|%d' % (os.path.relpath(f, dataset_dir), stat.st_size, int(stat.st_mtime))).encode())
+    name = os.path.basename(os.path.normpath(dataset_dir))
+    cache_path = os.path.join(cache_dir, '%s_%s.npz' % (name, key.hexdigest()[:16]))
+
+    if os.path.exists(cache_path):
+        cached = np.load(cache_path)
+        return cached['mu'], cached['sigma'], cached['features']
+
+    print(" [*] Computing reference statistics for {} ({} images)".format(dataset_dir, len(files)))
+    features = extractor(read_image(f) for f in files)
+    mu, sigma = features.mean(axis=0), np.cov(features, rowvar=False)
+    subset = features[np.random.RandomState(0).permutation(len(features))[:max_kid_features]]
+
+    if not os.path.exists(cache_dir):
+        os.makedirs(cache_dir)
+    tmp_path = cache_path + '.tmp.npz'
+    np.savez(tmp_path, mu=mu, sigma=sigma, features=subset)
+    os.replace(tmp_path, cache_path)
+    return mu, sigma, subset
+
+
+def fid(mu1, sigma1, mu2, sigma2):
+    # ||mu1 - mu2||^2 + Tr(S1 + S2 - 2 sqrt(S1 S2)); the eigenvalues of S1 S2 are real and non-negative
+    eigenvalues = np.linalg.eigvals(sigma1.dot(sigma2))
+    tr_covmean = np.sum(np.sqrt(np.clip(eigenvalues.real, 0, None)))
+    diff = mu1 - mu2
+    return float(diff.dot(diff) + np.trace(sigma1) + np.trace(sigma2) - 2. * tr_covmean)
+
+
+def kid(features1, features2, num_subsets=10, subset_size=1000, seed=0):
+    # unbiased MMD^2 with the cubic polynomial kernel, averaged over random subsets
+    rng = np.random.RandomState(seed)
+    n = min(len(features1), len(features2), subset_size)
+    if n < 2:
+        return None
+    d = features1.shape[1]
+    scores = []
+    for _ in range(num_subsets):
+        x = features1[rng.choice(len(features1), n, replace=False)]
+        y = features2[rng.choice(len(features2), n, replace=False)]
+        k_xx = (x.dot(x.T) / d + 1) ** 3
+        k_yy = (y.dot(y.T) / d + 1) ** 3
+        k_xy = (x.dot(y.T) / d + 1) ** 3
+        scores.append((k_xx.sum() - np.trace(k_xx) + k_yy.sum() - np.trace(k_yy)) / (n * (n - 1))
+                      - 2. * k_xy.mean())
+    return float(np.mean(scores))
+
+
+def distance(features, reference):
+    mu, sigma, reference_features = reference
+    if len(features) < 2:
+        return {'fid': None, 'kid': None, 'images': len(features)}
+    return {'fid': fid(features.mean(axis=0), np.cov(features, rowvar=False), mu, sigma),
+            'kid': kid(features, reference_features), 'images': len(features)}
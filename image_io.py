@@ -0,0 +1,193 @@
+"""Image input and output for the test and validation loops.
+
+ImageLoader decodes an input straight to 8 bit RGB, using the JPEG decoder's
+DCT scaling (1/2, 1/4, 1/8) when a max_side cap makes the full resolution
+unnecessary, resizes it to the working size while still 8 bit, and converts
+it into a reused float32 input buffer in the last step.
+
+AsyncImageWriter converts generated arrays to 8 bit, matches their brightness
+to the already decoded source photo, encodes them and writes the files on a
+bounded thread pool, so the generator never waits on encoding or disk.
+"""
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import cv2
+import numpy as np
+
+from inference import working_size
+
+# ITU-R BT.601 luma weights for R, G, B
+LUMA = np.array([0.299, 0.587, 0.114], dtype=np.float32)
+
+JPEG_EXTENSIONS = ('.jpg', '.jpeg', '.jpe', '.jfif')
+REDUCED_FLAGS = [(8, cv2.IMREAD_REDUCED_COLOR_8), (4, cv2.IMREAD_REDUCED_COLOR_4), (2, cv2.IMREAD_REDUCED_COLOR_2)]
+# zlib level of png output; png is lossless, so --out_quality does not apply to it
+PNG_COMPRESSION = 3
+
+
+def image_size(path):
+    # (h, w) from the file header without decoding the pixels
+    from PIL import Image
+    with Image.open(path) as img:
+        w, h = img.size
+    return h, w
+
+
+def decode_image(path, max_side=0, rgb=True):
+    # uint8 image; with max_side, JPEGs are decoded at the largest DCT scale whose longer side still reaches max_side
+    flag = cv2.IMREAD_COLOR
+    if max_side and path.lower().endswith(JPEG_EXTENSIONS):
+        longer = max(image_size(path))
+        for factor, reduced_flag in REDUCED_FLAGS:
+            if longer // factor >= max_side:
+                flag = reduced_flag
+                break
+    img = cv2.imread(path, flag)
+    if img is None:
+        raise IOError("Could not read " + path)
+    return cv2.cvtColor(img, cv2.COLOR_BGR2RGB) if rgb else img
+
+
+def resize_to(img, h, w):
+    # bilinear like tools.utils.preprocessing for the trim to a multiple of 32, area averaging when shrinking
+    if img.shape[:2] == (h, w):
+        return img
+    shrinking = h * w < 0.8 * img.shape[0] * img.shape[1]
+    return cv2.resize(img, (w, h), interpolation=cv2.INTER_AREA if shrinking else cv2.INTER_LINEAR)
+
+
+class ImageLoader(object):
+    """load_test_data without the float copies at native resolution.
+
+    load() returns the float32 [1, h, w, 3] input in [-1, 1] as a view of a
+    buffer that is reused by the next call, together with the 8 bit photo at
+    the working size, which the caller may keep (e.g. for AsyncImageWriter).
+    """
+
+    def __init__(self, size, max_side=0):
+        self.size = size
+        self.max_side = max_side
+        self.buffer = np.empty(0, dtype=np.float32)
+
+
+    def read(self, path):
+        img = decode_image(path, self.max_side)
+        h, w = working_size(img.shape[0], img.shape[1], self.size, self.max_side)
+        return resize_to(img, h, w)
+
+
+    def to_input(self, rgb):
+        h, w = rgb.shape[:2]
+        if self.buffer.size < h * w * 3:
+            self.buffer = np.empty(h * w * 3, dtype=np.float32)
+        x = self.buffer[:h * w * 3].reshape(1, h, w, 3)
+        x[0] = rgb
+        x *= 1. / 127.5
+        x -= 1.
+        return x
+
+
+    def load(self, path):
+        rgb = self.read(path)
+        return self.to_input(rgb), rgb
+
+
+def load_image(path, size, max_side=0):
+    # drop-in for tools.utils.load_test_data for callers that keep every image; a fresh loader owns its buffer
+    return ImageLoader(size, max_side).load(path)[0]
+
+
+def inverse_transform(images):
+    # float in [-1, 1] or uint8 (optionally with a leading batch axis of 1) -> uint8 RGB
+    images = np.asarray(images)
+    if images.ndim == 4:
+        images = images[0]
+    if images.dtype == np.uint8:
+        return images
+    return np.clip((images.astype(np.float32) + 1.) * 127.5, 0, 255).astype(np.uint8)
+
+
+def match_brightness(fake, photo):
+    # scale fake so its mean luma equals the photo's; same result as adjust_brightness_from_src_to_dst
+    photo_luma = photo.reshape(-1, 3).mean(axis=0, dtype=np.float64).dot(LUMA)
+    fake_luma = fake.reshape(-1, 3).mean(axis=0, dtype=np.float64).dot(LUMA)
+    scaled = fake.astype(np.float32)
+    scaled *= photo_luma / max(fake_luma, 1e-8)
+    np.clip(scaled, 0, 255, out=scaled)
+    return scaled.astype(np.uint8)
+
+
+def encode_params(fmt, quality):
+    if not 0 <= quality <= 100:
+        raise ValueError("Output quality must be in [0, 100], got %s" % quality)
+    if fmt in ('jpg', 'jpeg'):
+        return [cv2.IMWRITE_JPEG_QUALITY, int(quality)]
+    if fmt == 'webp':
+        return [cv2.IMWRITE_WEBP_QUALITY, max(1, int(quality))]
+    if fmt == 'png':
+        return [cv2.IMWRITE_PNG_COMPRESSION, PNG_COMPRESSION]
+    raise ValueError("Unsupported output format " + fmt)
+
+
+def write_image(rgb, path, params):
+    ok, encoded = cv2.imencode(os.path.splitext(path)[1], cv2.cvtColor(rgb, cv2.COLOR_RGB2BGR), params)
+    if not ok:
+        raise IOError("Could not encode " + path)
+    with open(path, 'wb') as f:
+        f.write(encoded.tobytes())
+
+
+class AsyncImageWriter(object):
+
+    def __init__(self, workers=2, max_pending=8, fmt='jpg', quality=95, save_real=True):
+        self.fmt = fmt.lower().lstrip('.')
+        self.params = encode_params(self.fmt, quality)
+        self.save_real = save_real
+        self.executor = ThreadPoolExecutor(max_workers=workers)
+        self.pending = threading.BoundedSemaphore(max_pending)
+        self.errors = []
+
+
+    def submit(self, generated, real, path_stem, on_done=None, on_error=None):
+        # generated: float array in [-1, 1], real: the same or uint8 RGB; writes <path_stem>_b (brightness matched to real) and <path_stem>_a,
+        # then calls on_done() on the writer thread once both files are complete; on_error(exception) takes over a failure from close()
+        self.pending.acquire()
+        try:
+            future = self.executor.submit(self._write, generated, real, path_stem, on_done, on_error)
+        except Exception:
+            self.pending.release()
+            raise
+        future.add_done_callback(self._done)
+
+
+    def _write(self, generated, real, path_stem, on_done=None, on_error=None):
+        try:
+            fake = inverse_transform(generated)
+            if real is not None:
+                photo = inverse_transform(real)
+                if self.save_real:
+                    write_image(photo, path_stem + '_a.' + self.fmt, self.params)
+                # adjust_brightness_from_photo_to_fake
+                fake = match_brightness(fake, photo)
+            write_image(fake, path_stem + '_b.' + self.fmt, self.params)
+            if on_done is not None:
+                on_done()
+        except Exception as e:
+            if on_error is None:
+                raise
+            on_error(e)
+
+
+    def _done(self, future):
+        self.pending.release()
+        if future.exception() is not None:
+            self.errors.append(future.exception())
+
+
+    def close(self):
+        # wait for every queued image and surface the first failure
+        self.executor.shutdown(wait=True)
+        if self.errors:
+            raise self.errors[0]
@@ -0,0 +1,219 @@
+"""Incremental re-rendering of edited images for the UI.
+
+IncrementalRenderer keeps the last processed input and its cartoon. A new
+input is diffed against it tile by tile. Only the tiles that changed are
+generated again, with a margin of surrounding context so the generator sees
+the same neighbourhood as in a full run, and composited into the cached
+result with a short feathered seam. A crop of the last input is located in
+it first, so cropping reuses the cached cartoon too. A sparse group of
+edited tiles, such as a thin diagonal stroke, is regenerated row by row
+rather than as its bounding box. Anything else (a new photo, a different
+processing scale, an edit touching most tiles, or regions whose margins add
+up to a full frame) is a full run. The cost of an edit is then proportional
+to its area.
+
+The generator normalizes over the whole input, so re-rendered tiles can
+differ slightly in tone from a full run; the feathering hides the seam.
+"""
+import time
+
+import cv2
+import numpy as np
+
+from inference import to_input, to_output
+
+
+def feather_weights(lo, hi, core_lo, core_hi, feather):
+    # 1 on [core_lo, core_hi), falling linearly to 0 over `feather` pixels outside it
+    position = np.arange(lo, hi)
+    distance = np.maximum(np.maximum(core_lo - position, position - (core_hi - 1)), 0)
+    return 1. - distance / (feather + 1.)
+
+
+class IncrementalRenderer(object):
+
+    def __init__(self, backend, max_side=0, tile=64, margin=64, feather=16, threshold=8, max_dirty=0.5, align=32,
+                 min_size=(256, 256)):
+        # backend: an inference.Backend; threshold is the per-pixel 8 bit difference that marks a pixel as edited;
+        # sides below min_size are stretched to it, as inference.working_size does for --phase test
+        self.backend = backend
+        self.max_side = max_side
+        self.min_size = min_size
+        self.tile = tile
+        self.margin = margin
+        self.feather = min(feather, margin)
+        self.threshold = threshold
+        self.max_dirty = max_dirty
+        self.align = align
+        self.invalidate()
+
+
+    def invalidate(self):
+        # forget the cache, e.g. after switching the backend or its settings
+        self.input = None
+        self.output = None
+        self.scale = None
+
+
+    def scaled(self, img_rgb):
+        # the whole image is brought to the processing scale here, so full runs and regenerated tiles share it;
+        # the returned (y, x) scale tells whether the cache was rendered at the same one
+        H, W = img_rgb.shape[:2]
+        scale = min(1., self.max_side / float(max(H, W))) if self.max_side else 1.
+        h, w = max(1, int(round(H * scale))), max(1, int(round(W * scale)))
+        if scale < 1.:
+            img_rgb = cv2.resize(img_rgb, (w, h), interpolation=cv2.INTER_AREA)
+        if h < self.min_size[0] or w < self.min_size[1]:
+            h, w = max(h, self.min_size[0]), max(w, self.min_size[1])
+            img_rgb = cv2.resize(img_rgb, (w, h), interpolation=cv2.INTER_LINEAR)
+        return img_rgb, (h / float(H), w / float(W))
+
+
+    def generate(self, img):
+        # uint8 RGB of any size -> uint8 RGB, reflect padded at the bottom/right to the generator's alignment
+        h, w = img.shape[:2]
+        pad_h, pad_w = -h % self.align, -w % self.align
+        if pad_h or pad_w:
+            img = cv2.copyMakeBorder(img, 0, pad_h, 0, pad_w, cv2.BORDER_REFLECT_101)
+        generated = self.backend.run(to_input(img, img.shape[0], img.shape[1])[np.newaxis])[0]
+        return to_output(generated)[:h, :w]
+
+
+    def locate(self, x):
+        # offset of x inside the cached input, searched coarsely and refined at full resolution
+        h, w = x.shape[:2]
+        prev_gray = cv2.cvtColor(self.input, cv2.COLOR_RGB2GRAY)
+        x_gray = cv2.cvtColor(x, cv2.COLOR_RGB2GRAY)
+        step = 4 if min(h, w) >= 32 * 4 else 1
+        coarse = cv2.matchTemplate(cv2.resize(prev_gray, None, fx=1. / step, fy=1. / step, interpolation=cv2.INTER_AREA),
+                                   cv2.resize(x_gray, None, fx=1. / step, fy=1. / step, interpolation=cv2.INTER_AREA),
+                                   cv2.TM_SQDIFF)
+        _, _, (sx, sy), _ = cv2.minMaxLoc(coarse)
+
+        ph, pw = prev_gray.shape
+        y0, x0 = max(0, sy * step - step), max(0, sx * step - step)
+        y1, x1 = min(ph, sy * step + step + h), min(pw, sx * step + step + w)
+        fine = cv2.matchTemplate(prev_gray[y0:y1, x0:x1], x_gray, cv2.TM_SQDIFF)
+        _, _, (fx, fy), _ = cv2.minMaxLoc(fine)
+        oy, ox = y0 + fy, x0 + fx
+
+        # accept only a real crop: most pixels match
+        diff = cv2.absdiff(self.input[oy:oy + h, ox:ox + w], x).max(axis=2)
+        if np.mean(diff > self.threshold) > self.max_dirty:
+            return None
+        return oy, ox
+
+
+    def reference(self, x, scale):
+        # cached (input, output) aligned with x and which of its edges (top, bottom, left, right) were cut, or None
+        if self.input is None or scale != self.scale:
+            return None
+        if self.input.shape == x.shape:
+            return self.input, self.output, (False, False, False, False)
+        h, w = x.shape[:2]
+        ph, pw = self.input.shape[:2]
+        if h > ph or w > pw:
+            return None
+        offset = self.locate(x)
+        if offset is None:
+            return None
+        oy, ox = offset
+        return (self.input[oy:oy + h, ox:ox + w], self.output[oy:oy + h, ox:ox + w],
+                (oy > 0, oy + h < ph, ox > 0, ox + w < pw))
+
+
+    def dirty_tiles(self, x, previous, cut):
+        h, w = x.shape[:2]
+        rows, cols = -(-h // self.tile), -(-w // self.tile)
+        dirty = np.zeros((rows * self.tile, cols * self.tile), dtype=bool)
+        dirty[:h, :w] = cv2.absdiff(x, previous).max(axis=2) > self.threshold
+        tiles = dirty.reshape(rows, self.tile, cols, self.tile).any(axis=(1, 3))
+
+        # next to a cut edge the generator saw other context before, so those tiles are regenerated too
+        band = -(-self.margin // self.tile)
+        top, bottom, left, right = cut
+        if top:
+            tiles[:band] = True
+        if bottom:
+            tiles[-band:] = True
+        if left:
+            tiles[:, :band] = True
+        if right:
+            tiles[:, -band:] = True
+        return tiles
+
+
+    def regions(self, tiles, h, w):
+        # pixel cores (y0, y1, x0, x1) to regenerate: one per 8-connected group of dirty tiles, or, for a sparse
+        # group such as a thin diagonal stroke whose bounding box is mostly clean, one per run of tiles in each row
+        count, labels, stats, _ = cv2.connectedComponentsWithStats(tiles.astype(np.uint8), connectivity=8)
+        cores = []
+        for label in range(1, count):
+            tx, ty, tw, th, area = stats[label]
+            if tw * th <= 2 * area:
+                cores.append((ty, ty + th, tx, tx + tw))
+                continue
+            for row in range(ty, ty + th):
+                columns = np.flatnonzero(labels[row, tx:tx + tw] == label) + tx
+                for run in np.split(columns, np.flatnonzero(np.diff(columns) > 1) + 1):
+                    if run.size:
+                        cores.append((row, row + 1, run[0], run[-1] + 1))
+        return [(ty * self.tile, min(h, ty1 * self.tile), tx * self.tile, min(w, tx1 * self.tile))
+                for ty, ty1, tx, tx1 in cores]
+
+
+    def context(self, h, w, y0, y1, x0, x1):
+        # the core [y0:y1, x0:x1] with its margin, aligned to the grid of a full run
+        a = self.align
+        cy0, cx0 = max(0, y0 - self.margin) // a * a, max(0, x0 - self.margin) // a * a
+        cy1, cx1 = min(h, -(-(y1 + self.margin) // a) * a), min(w, -(-(x1 + self.margin) // a) * a)
+        return cy0, cy1, cx0, cx1
+
+
+    def update_region(self, x, output, y0, y1, x0, x1):
+        # regenerate the core [y0:y1, x0:x1] with context and blend it in
+        h, w = x.shape[:2]
+        cy0, cy1, cx0, cx1 = self.context(h, w, y0, y1, x0, x1)
+        generated = self.generate(x[cy0:cy1, cx0:cx1])
+
+        fy0, fy1 = max(cy0, y0 - self.feather), min(cy1, y1 + self.feather)
+        fx0, fx1 = max(cx0, x0 - self.feather), min(cx1, x1 + self.feather)
+        weight = np.minimum.outer(feather_weights(fy0, fy1, y0, y1, self.feather),
+                                  feather_weights(fx0, fx1, x0, x1, self.feather)).astype(np.float32)[..., np.newaxis]
+
+        new = generated[fy0 - cy0:fy1 - cy0, fx0 - cx0:fx1 - cx0].astype(np.float32)
+        old = output[fy0:fy1, fx0:fx1].astype(np.float32)
+        output[fy0:fy1, fx0:fx1] = np.clip(old + weight * (new - old) + 0.5, 0, 255).astype(np.uint8)
+
+
+    def render(self, img_rgb):
+        # uint8 RGB -> (uint8 RGB cartoon of the same size, info about what was regenerated)
+        start_time = time.time()
+        H, W = img_rgb.shape[:2]
+        x, scale = self.scaled(img_rgb)
+        h, w = x.shape[:2]
+
+        reference = self.reference(x, scale)
+        info = {'mode': 'full', 'dirty_fraction': 1., 'regions': 1, 'size': (h, w)}
+        if reference is not None:
+            previous_input, previous_output, cut = reference
+            tiles = self.dirty_tiles(x, previous_input, cut)
+            info['dirty_fraction'] = float(tiles.mean())
+            regions = self.regions(tiles, h, w) if info['dirty_fraction'] <= self.max_dirty else None
+            # the generator runs on each region with its margin; when those add up to a full frame, a full run is cheaper
+            if regions is not None and sum((cy1 - cy0) * (cx1 - cx0) for cy0, cy1, cx0, cx1 in
+                                           (self.context(h, w, *region) for region in regions)) < h * w:
+                output = previous_output.copy()
+                for region in regions:
+                    self.update_region(x, output, *region)
+                info['regions'] = len(regions)
+                info['mode'] = 'crop' if any(cut) else ('incremental' if regions else 'unchanged')
+
+        if info['mode'] == 'full':
+            output = self.generate(x)
+
+        self.input, self.output, self.scale = x, output, scale
+        info['seconds'] = time.time() - start_time
+        if (h, w) != (H, W):
+            output = cv2.resize(output, (W, H), interpolation=cv2.INTER_LINEAR)
+        return output, info
@@ -0,0 +1,123 @@
+"""Helpers shared by the inference entry points (video, UI) and a standalone generator session."""
+import json
+import os
+
+import cv2
+import numpy as np
+
+
+def working_size(h, w, size, max_side=0):
+    # same policy as tools.utils.preprocessing: at least `size`, otherwise rounded down to a multiple of 32;
+    # max_side > 0 additionally caps the longer side so large inputs can be processed at reduced resolution
+    if max_side and max(h, w) > max_side:
+        scale = max_side / float(max(h, w))
+        h, w = int(round(h * scale)), int(round(w * scale))
+    h = size[0] if h <= size[0] else h - h % 32
+    w = size[1] if w < size[1] else w - w % 32
+    return h, w
+
+
+def to_input(img_rgb, h, w):
+    # uint8 RGB -> float32 in [-1, 1] at the working size
+    if img_rgb.shape[:2] != (h, w):
+        img_rgb = cv2.resize(img_rgb, (w, h), interpolation=cv2.INTER_AREA)
+    return img_rgb.astype(np.float32) / 127.5 - 1.0
+
+
+def to_output(generated, h=None, w=None):
+    # float in [-1, 1] -> uint8 RGB, optionally resized back to (h, w)
+    img = np.clip((generated + 1.) * 127.5, 0, 255).astype(np.uint8)
+    if h is not None and img.shape[:2] != (h, w):
+        img = cv2.resize(img, (w, h), interpolation=cv2.INTER_LINEAR)
+    return img
+
+
+def checkpoint_path(checkpoint_dir, epoch=None, model_name='AnimeStyle'):
+    # checkpoint_dir is the model specific folder, e.g. checkpoint/AnimeStyle_TWR_g300.0_...
+    import tensorflow as tf
+    if epoch is not None:
+        return checkpoint_dir.rstrip('/\\') + '/' + model_name + '.model-' + str(epoch)
+    ckpt = tf.train.get_checkpoint_state(checkpoint_dir)
+    if not (ckpt and ckpt.model_checkpoint_path):
+        raise IOError("No checkpoint found in " + checkpoint_dir)
+    return ckpt.model_checkpoint_path
+
+
+STUDENT_CONFIG = 'student.json'
+
+
+def load_student_config(checkpoint_dir):
+    path = os.path.join(checkpoint_dir, STUDENT_CONFIG)
+    if not os.path.exists(path):
+        return None
+    with open(path) as f:
+        return json.load(f)
+
+
+class Backend(object):
+    """Generator runtime behind test_epoch, the UI and the batch tools; see backends.create_backend."""
+
+    name = None
+
+    def run(self, batch):
+        # float32 [b, h, w, 3] in [-1, 1] -> generated batch in [-1, 1]
+        raise NotImplementedError
+
+
+    def cartoonize(self, img_rgb, h, w):
+        # uint8 RGB of any size -> uint8 RGB of the same size, processed at (h, w)
+        generated = self.run(to_input(img_rgb, h, w)[np.newaxis])[0]
+        return to_output(generated, img_rgb.shape[0], img_rgb.shape[1])
+
+
+    def close(self):
+        pass
+
+
+class GeneratorSession(Backend):
+    """TensorFlow backend: generator-only graph and session restored from an AnimeStyle checkpoint.
+
+    Only the generator network is imported, so neither the training graph nor
+    VGG19 is built. Used where there is no AnimeStyle instance, e.g. the UI.
+    A distilled student checkpoint folder (see AnimeStyle.train_distill) is
+    recognised by its student.json and loaded with the student network.
+    """
+
+    name = 'tf'
+
+    def __init__(self, checkpoint_dir, epoch=None, img_ch=3, threads=4):
+        import tensorflow as tf
+
+        student_config = load_student_config(checkpoint_dir)
+        self.graph = tf.Graph()
+        with self.graph.as_default():
+            self.test_real = tf.placeholder(tf.float32, [None, None, None, img_ch], name='test_input')
+            if student_config is None:
+                from net.generator import G_net_unet
+                with tf.variable_scope('generator'):
+                    self.test_generated = G_net_unet(self.test_real)
+            else:
+                from net.student import G_net_student
+                with tf.variable_scope('student'):
+                    self.test_generated = G_net_student(self.test_real, **student_config)
+            config = tf.ConfigProto(allow_soft_placement=True, inter_op_parallelism_threads=threads,
+                                    intra_op_parallelism_threads=threads,
+                                    gpu_options=tf.GPUOptions(allow_growth=True))
+            self.sess = tf.Session(config=config)
+            self.saver = tf.train.Saver()
+        self.restore(checkpoint_path(checkpoint_dir, epoch))
+
+
+    def restore(self, path):
+        # swap in the weights of another checkpoint without rebuilding the graph
+        self.saver.restore(self.sess, path)
+        self.path = path
+        print(" [*] Success to read {}".format(path))
+
+
+    def run(self, batch):
+        return self.sess.run(self.test_generated, feed_dict={self.test_real: batch})
+
+
+    def close(self):
+        self.sess.close()
@@ -1,10 +1,22 @@
-from model import AnimeStyle
 import argparse
-from tools.utils import *
 import os
 
 os.environ["CUDA_VISIBLE_DEVICES"] = "0"
 
+# TensorFlow, the networks and VGG19 are imported inside main() once the arguments are valid,
+# so --help and argument errors return immediately; tools.utils imports TensorFlow, so the two helpers
+# argument parsing needs are kept here as TensorFlow-free equivalents of tools.utils.str2bool/check_folder
+
+
+def str2bool(x):
+    return x.lower() in ('true')
+
+
+def check_folder(log_dir):
+    if not os.path.exists(log_dir):
+        os.makedirs(log_dir)
+    return log_dir
+
 
 """parsing and configuration"""
 
@@ -13,7 +25,7 @@ def parse_args():
     desc = "AnimeStyle"
     parser = argparse.ArgumentParser(description=desc)
 
-    parser.add_argument('--phase', type=str, default='test', help='train or test?')
+    parser.add_argument('--phase', type=str, default='test', help='train, test, video, evaluate or distill?')
     parser.add_argument('--dataset', type=str, default='TWR', help='dataset name')
     parser.add_argument('--g_adv_weight', type=float, default=300.0, help='weight of adversarial loss for generator')
     parser.add_argument('--d_adv_weight', type=float, default=300.0, help='weight of adversarial loss for discriminator')
@@ -25,14 +37,58 @@ def parse_args():
     parser.add_argument('--epoch', type=int, default=80, help='number of training epochs')
     parser.add_argument('--init_epoch', type=int, default=10, help='number of training epochs in initialization stage')
     parser.add_argument('--batch_size', type=int, default=8, help='batch size')
+    parser.add_argument('--accum_steps', type=int, default=1,
+                        help='split each batch into this many micro-batches and accumulate their gradients')
     parser.add_argument('--save_freq', type=int, default=5, help='number of training epochs after every which model checkpoint is saved')
     parser.add_argument('--init_lr', type=float, default=2e-4, help='learning rate at initialization stage')
     parser.add_argument('--g_lr', type=float, default=2e-5, help='initial learning rate of the generator')
     parser.add_argument('--d_lr', type=float, default=1e-5, help='initial learning rate of the discriminator')
     parser.add_argument('--img_size', type=list, default=[256, 256], help='size of input image')
+    parser.add_argument('--resolution_schedule', type=str, default='',
+                        help='progressive training, e.g. 128:5,192:15,256 trains at 128 up to epoch 5, 192 up to 15, then 256')
     parser.add_argument('--img_ch', type=int, default=3, help='number of image channel')
     parser.add_argument('--sn', type=str2bool, default=True, help='whether to use spectral norm')
     parser.add_argument('--val_freq', type=int, default=5, help='number of training epochs after every which validation is performed')
+    parser.add_argument('--val_mode', type=str, default='async',
+                        help='async: validate checkpoints in a separate worker process, sync: validate inside the training loop')
+    parser.add_argument('--val_device', type=str, default='',
+                        help='CUDA_VISIBLE_DEVICES of the validation worker, empty runs it on the CPU')
+    parser.add_argument('--val_fid', type=str2bool, default=False, help='whether the validation worker also reports FID/KID')
+    parser.add_argument('--fid_size', type=int, default=224, help='image size fed to VGG19 for FID/KID features')
+    parser.add_argument('--fid_cache', type=str, default='fid_cache', help='folder for cached reference statistics')
+
+    parser.add_argument('--video', type=str, default='', help='input video for the video phase')
+    parser.add_argument('--video_batch', type=int, default=4, help='number of video frames per generator run')
+    parser.add_argument('--video_reuse_threshold', type=float, default=1.5,
+                        help='mean abs difference (0-255) below which a frame reuses the previous output, 0 disables reuse')
+    parser.add_argument('--video_max_side', type=int, default=0, help='cap on the longer side of processed video frames, 0 for no cap')
+
+    parser.add_argument('--student_ch', type=int, default=16, help='base channel count of the distilled student generator')
+    parser.add_argument('--student_blocks', type=int, default=4, help='number of residual blocks of the student generator')
+    parser.add_argument('--distill_epoch', type=int, default=20, help='number of distillation epochs')
+    parser.add_argument('--distill_lr', type=float, default=2e-4, help='learning rate of the student generator')
+    parser.add_argument('--distill_con_weight', type=float, default=0., help='weight of the VGG content loss against the teacher output')
+    parser.add_argument('--distill_color_weight', type=float, default=0., help='weight of the color loss against the teacher output')
+    parser.add_argument('--teacher_epoch', type=int, default=0, help='teacher checkpoint epoch, 0 for the latest')
+
+    parser.add_argument('--out_format', type=str, default='jpg', help='format of saved test and validation images: jpg, png or webp')
+    parser.add_argument('--out_quality', type=int, default=95, help='encoding quality 0-100 of saved jpg/webp images')
+    parser.add_argument('--save_real', type=str2bool, default=True, help='whether to also save the resized input photo (_a)')
+    parser.add_argument('--writer_threads', type=int, default=2, help='threads that encode and write output images')
+
+    parser.add_argument('--max_side', type=int, default=0,
+                        help='decode and process test images with the longer side capped at this, 0 for full resolution')
+    parser.add_argument('--backend', type=str, default='tf', help='runtime of the test phase generator: tf or onnx')
+
+    parser.add_argument('--mem_report', type=str, default='',
+                        help='write peak memory and allocator statistics per phase to this JSON file')
+    parser.add_argument('--mem_budget', type=float, default=0., help='fail as soon as a phase exceeds this peak RSS in MB, 0 to disable')
+    parser.add_argument('--gpu_mem_budget', type=float, default=0., help='fail as soon as a phase exceeds this GPU allocator peak in MB')
+
+    parser.add_argument('--latency_budget', type=float, default=0.,
+                        help='seconds per test image; picks the processing resolution from the cost model, 0 disables it')
+    parser.add_argument('--cost_model', type=str, default='cost_model.json',
+                        help='per-host latency history used to choose the processing resolution')
 
 
     parser.add_argument('--checkpoint_dir', type=str, default='checkpoint',
@@ -49,16 +105,6 @@ def parse_args():
 
 """checking arguments"""
 def check_args(args):
-    # --checkpoint_dir
-    check_folder(args.checkpoint_dir)
-
-    if args.phase == 'test':
-        # --result_dir
-        check_folder(args.result_dir)
-    else:
-        check_folder(args.init_checkpoint_dir)
-        check_folder(args.sample_dir)
-
     try:
         assert args.epoch >= 1
     except:
@@ -69,9 +115,89 @@ def check_args(args):
         assert args.batch_size >= 1
     except:
         print('batch size must be larger than or equal to one')
+
+    # --accum_steps
+    if args.accum_steps < 1 or args.batch_size % args.accum_steps != 0:
+        print('batch size must be divisible by accum_steps')
+        return None
+    if args.phase == 'distill' and args.accum_steps > 1:
+        print('accum_steps is ignored by distillation, which trains on whole batches of batch_size')
+
+    # --out_format
+    if args.out_format.lower() not in ('jpg', 'jpeg', 'png', 'webp'):
+        print('out_format must be jpg, png or webp')
+        return None
+
+    # --out_quality
+    if not 0 <= args.out_quality <= 100:
+        print('out_quality must be in [0, 100]')
+        return None
+
+    # --backend
+    if args.backend not in ('tf', 'onnx'):
+        print('backend must be tf or onnx')
+        return None
+
+    # --resolution_schedule
+    if args.resolution_schedule:
+        try:
+            stages = parse_schedule(args.resolution_schedule, args.img_size, args.epoch)
+            assert all(size % 32 == 0 for size, _ in stages)
+            assert all(a[1] < b[1] for a, b in zip(stages, stages[1:]))
+            assert stages[-1] == (args.img_size[0], args.epoch)
+        except (ValueError, AssertionError):
+            print('resolution_schedule must be size:last_epoch pairs with increasing epochs, sizes divisible by 32, '
+                  'ending at img_size')
+            return None
+
+    # --val_mode
+    if args.val_mode not in ('sync', 'async'):
+        print('val_mode must be sync or async')
+        return None
+
+    # --video
+    if args.phase == 'video' and not os.path.isfile(args.video):
+        print('--video must point to an existing video file')
+        return None
+
+    # output folders are created once the arguments are known to be valid
+    # --checkpoint_dir
+    check_folder(args.checkpoint_dir)
+
+    if args.phase in ('test', 'video', 'evaluate', 'distill'):
+        # --result_dir
+        check_folder(args.result_dir)
+    else:
+        check_folder(args.init_checkpoint_dir)
+        check_folder(args.sample_dir)
     return args
 
 
+"""resolution schedule"""
+def parse_schedule(schedule, img_size, epoch):
+    # "128:5,192:15,256" -> [(128, 5), (192, 15), (256, epoch)]; a final stage at img_size is added if needed
+    stages = []
+    for item in schedule.split(','):
+        size, _, last_epoch = item.strip().partition(':')
+        stages.append((int(size), int(last_epoch) if last_epoch else epoch))
+    if stages[-1][1] < epoch:
+        stages.append((img_size[0], epoch))
+    return stages
+
+
+def resolution_stages(args):
+    # one copy of the arguments per stage, training up to the stage's last epoch at the stage's resolution
+    import copy
+
+    stages = []
+    for size, last_epoch in parse_schedule(args.resolution_schedule, args.img_size, args.epoch):
+        stage_args = copy.copy(args)
+        stage_args.img_size = [size, size]
+        stage_args.epoch = last_epoch
+        stages.append(stage_args)
+    return stages
+
+
 """main"""
 def main():
     # parse arguments
@@ -79,27 +205,66 @@ def main():
     if args is None:
         exit()
 
-    # open session
-    gpu_options = tf.GPUOptions(allow_growth=True)
-    with tf.Session(config=tf.ConfigProto(allow_soft_placement=True, inter_op_parallelism_threads=8,
-                               intra_op_parallelism_threads=8, gpu_options=gpu_options)) as sess:
+    import tensorflow as tf
+    from model import AnimeStyle
+    from tools.utils import show_all_variables
+    from memprof import MemoryProfiler
+
+    memory = MemoryProfiler(args.mem_report, args.mem_budget, args.gpu_mem_budget)
+
+    # progressive training rebuilds the graph for every resolution stage and continues from the last checkpoint
+    stages = [args]
+    if args.phase == 'train' and args.resolution_schedule:
+        stages = resolution_stages(args)
+
+    for stage, stage_args in enumerate(stages):
+        if len(stages) > 1:
+            tf.reset_default_graph()
+            print(" [*] Resolution stage %d / %d: %dx%d up to epoch %d" % (
+                stage + 1, len(stages), stage_args.img_size[0], stage_args.img_size[1], stage_args.epoch))
+
+        # open session
+        gpu_options = tf.GPUOptions(allow_growth=True)
+        with tf.Session(config=tf.ConfigProto(allow_soft_placement=True, inter_op_parallelism_threads=8,
+                                   intra_op_parallelism_threads=8, gpu_options=gpu_options)) as sess:
+
+            memory.attach(sess)
+            model = AnimeStyle(sess, stage_args, memory)
+
+            # build graph
+            with memory.phase('graph_build'):
+                model.build_model()
+
+            # show network architecture
+            show_all_variables()
+
+            if args.phase == 'train':
+                model.train()
+                print(" [*] Training finished!")
 
-        model = AnimeStyle(sess, args)
+            if args.phase == 'test':
+                model.test_epoch(70)    # for TWR style
+                # model.test_epoch(80)  # for DB and CSC style
+                print(" [*] Test finished!")
 
-        # build graph
-        model.build_model()
+            if args.phase == 'video':
+                model.test_video(args.video, 70)    # for TWR style
+                print(" [*] Video finished!")
 
-        # show network architecture
-        show_all_variables()
+            if args.phase == 'distill':
+                model.train_distill()
+                print(" [*] Distillation finished!")
 
-        if args.phase == 'train':
-            model.train()
-            print(" [*] Training finished!")
+            if args.phase == 'evaluate':
+                model.evaluate_checkpoints()
+                print(" [*] Evaluation finished!")
 
-        if args.phase == 'test':
-            model.test_epoch(70)    # for TWR style
-            # model.test_epoch(80)  # for DB and CSC style
-            print(" [*] Test finished!")
+    if memory.enabled:
+        memory.close()
+        print(" [*] Peak memory per phase:")
+        print(memory.summary())
+        if args.mem_report:
+            print("Memory report is saved in " + args.mem_report)
 
 
 if __name__ == '__main__':
@@ -0,0 +1,199 @@
+"""Per-phase memory instrumentation.
+
+MemoryProfiler samples the resident set size of the process on a background
+thread and, for every named phase (graph build, checkpoint restore, each
+train step type, validation, each test image resolution), keeps the peak RSS
+seen while the phase ran and its growth over the RSS at phase start. With a
+session attached it also reads the TensorFlow allocator statistics
+(bytes in use, peak bytes in use, limit) after each phase. Phases with the
+same name are aggregated. The report is written as JSON, and with a budget
+the phase that exceeds it raises MemoryBudgetExceeded as soon as it ends.
+"""
+import json
+import os
+import platform
+import sys
+import threading
+import time
+from contextlib import contextmanager
+
+MB = 1024. ** 2
+
+
+def current_rss():
+    # resident set size of this process in bytes
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (IOError, OSError, ValueError):
+        pass
+    try:
+        import psutil
+        return psutil.Process().memory_info().rss
+    except ImportError:
+        return peak_rss()
+
+
+def peak_rss():
+    # peak resident set size of this process over its lifetime in bytes
+    try:
+        import resource
+    except ImportError:
+        return 0
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak if sys.platform == 'darwin' else peak * 1024
+
+
+class MemoryBudgetExceeded(MemoryError):
+    pass
+
+
+class MemoryProfiler(object):
+
+    def __init__(self, report_path='', rss_budget=0., gpu_budget=0., interval=0.01):
+        # budgets in MB, 0 disables; without a report path or a budget every phase is a no-op
+        self.report_path = report_path
+        self.rss_budget = rss_budget
+        self.gpu_budget = gpu_budget
+        self.interval = interval
+        self.enabled = bool(report_path or rss_budget or gpu_budget)
+        self.phases = {}
+        self.active = []
+        self.lock = threading.Lock()
+        self.sess = None
+        self.allocator_ops = None
+        self.sampler = None
+        self.stopped = threading.Event()
+
+
+    def attach(self, sess):
+        # allocator statistics are read through ops of the session's graph, which are created on first use
+        self.sess = sess
+        self.allocator_ops = None
+
+
+    def _allocator_ops(self):
+        if self.allocator_ops is None:
+            import tensorflow as tf
+            self.allocator_ops = {}
+            devices = ['/cpu:0'] + (['/gpu:0'] if tf.test.is_gpu_available() else [])
+            with self.sess.graph.as_default(), tf.name_scope('memory_stats'):
+                for device in devices:
+                    with tf.device(device):
+                        self.allocator_ops[device.strip('/').replace(':0', '')] = {
+                            'in_use': tf.contrib.memory_stats.BytesInUse(),
+                            'peak': tf.contrib.memory_stats.MaxBytesInUse(),
+                            'limit': tf.contrib.memory_stats.BytesLimit()}
+        return self.allocator_ops
+
+
+    def allocator_stats(self):
+        # MB per device; the CPU allocator only reports when TensorFlow tracks its statistics
+        if self.sess is None:
+            return {}
+        stats = {}
+        for device, ops in self._allocator_ops().items():
+            values = self.sess.run(ops)
+            if values['limit'] or values['peak']:
+                stats[device] = {name: value / MB for name, value in values.items()}
+        return stats
+
+
+    def _sample(self):
+        while not self.stopped.wait(self.interval):
+            rss = current_rss()
+            with self.lock:
+                for record in self.active:
+                    record['peak'] = max(record['peak'], rss)
+
+
+    @contextmanager
+    def phase(self, name):
+        if not self.enabled:
+            yield
+            return
+        if self.sampler is None:
+            self.sampler = threading.Thread(target=self._sample, daemon=True)
+            self.sampler.start()
+
+        rss = current_rss()
+        record = {'start': rss, 'peak': rss}
+        with self.lock:
+            self.active.append(record)
+        start_time = time.time()
+        try:
+            yield
+        finally:
+            with self.lock:
+                self.active.remove(record)
+            record['peak'] = max(record['peak'], current_rss())
+            self._record(name, record, time.time() - start_time)
+        self._check(name)
+
+
+    def _record(self, name, record, seconds):
+        allocator = self.allocator_stats()
+        with self.lock:
+            stats = self.phases.setdefault(name, {'count': 0, 'seconds': 0., 'peak_rss_mb': 0., 'max_rss_growth_mb': 0.,
+                                                  'allocator': {}})
+            stats['count'] += 1
+            stats['seconds'] += seconds
+            stats['peak_rss_mb'] = max(stats['peak_rss_mb'], record['peak'] / MB)
+            stats['max_rss_growth_mb'] = max(stats['max_rss_growth_mb'], (record['peak'] - record['start']) / MB)
+            for device, values in allocator.items():
+                previous = stats['allocator'].setdefault(device, values)
+                previous['in_use'] = values['in_use']
+                previous['peak'] = max(previous['peak'], values['peak'])
+                previous['limit'] = values['limit']
+
+
+    def _check(self, name):
+        stats = self.phases[name]
+        exceeded = []
+        if self.rss_budget and stats['peak_rss_mb'] > self.rss_budget:
+            exceeded.append('RSS %.1f MB > %.1f MB' % (stats['peak_rss_mb'], self.rss_budget))
+        gpu = stats['allocator'].get('gpu')
+        if self.gpu_budget and gpu and gpu['peak'] > self.gpu_budget:
+            exceeded.append('GPU %.1f MB > %.1f MB' % (gpu['peak'], self.gpu_budget))
+        if exceeded:
+            self.save()
+            raise MemoryBudgetExceeded("Memory budget exceeded in phase %s: %s" % (name, ', '.join(exceeded)))
+
+
+    def report(self):
+        with self.lock:
+            phases = json.loads(json.dumps(self.phases))
+        for stats in phases.values():
+            stats['mean_seconds'] = stats.pop('seconds') / stats['count']
+        return {'host': platform.node(), 'pid': os.getpid(), 'peak_rss_mb': peak_rss() / MB,
+                'budget_mb': {'rss': self.rss_budget, 'gpu': self.gpu_budget}, 'phases': phases}
+
+
+    def summary(self):
+        lines = []
+        for name, stats in sorted(self.report()['phases'].items(), key=lambda item: -item[1]['peak_rss_mb']):
+            gpu = stats['allocator'].get('gpu')
+            lines.append("%-32s x%-6d peak RSS %8.1f MB  growth %8.1f MB%s" % (
+                name, stats['count'], stats['peak_rss_mb'], stats['max_rss_growth_mb'],
+                '  GPU peak %8.1f MB' % gpu['peak'] if gpu else ''))
+        return '\n'.join(lines)
+
+
+    def save(self):
+        if not self.report_path or not self.phases:
+            return
+        folder = os.path.dirname(self.report_path)
+        if folder and not os.path.exists(folder):
+            os.makedirs(folder)
+        tmp_path = self.report_path + '.tmp'
+        with open(tmp_path, 'w') as f:
+            json.dump(self.report(), f, indent=2)
+        os.replace(tmp_path, self.report_path)
+
+
+    def close(self):
+        self.stopped.set()
+        if self.sampler is not None:
+            self.sampler.join()
+            self.sampler = None
+        self.save()
@@ -1,23 +1,56 @@
-from tools.ops import *
-from tools.utils import *
+import tensorflow as tf
 from glob import glob
 import time
 import numpy as np
 from net.generator import G_net_unet
-from net.discriminator import D_net, patch_D_net
-from tools.data_loader import ImageGenerator
-from tools.vgg19 import Vgg19
-from tools.patch_extractor import extract_top_k_img_patches_by_sum
 from os.path import basename
 import os
+from memprof import MemoryProfiler, peak_rss
+
+# training-only modules (losses, discriminators, data loader, patch extractor, VGG19) are imported
+# where the training graph is built, so the test phase never loads them; tools.utils helpers are
+# imported by the methods that use them
+
+
+def format_peak_memory(sess=None, gpu_peak_op=None):
+    # peak resident set size of this process, plus the peak of the TensorFlow GPU allocator when gpu_peak_op is given
+    text = 'RSS %.1f MB' % (peak_rss() / 1024. ** 2)
+    if gpu_peak_op is not None:
+        text += ', GPU %.1f MB' % (sess.run(gpu_peak_op) / 1024. ** 2)
+    return text
+
+
+def profile_network(build, size, repeat=10):
+    # FLOPs (where static shapes are known) and single-image CPU latency of a network with random weights
+    graph = tf.Graph()
+    with graph.as_default(), tf.device('/cpu:0'):
+        x = tf.placeholder(tf.float32, [1, size, size, 3])
+        with tf.variable_scope('profile'):
+            y = build(x)
+        flops = tf.profiler.profile(graph, options=tf.profiler.ProfileOptionBuilder.float_operation()).total_float_ops
+        with tf.Session(config=tf.ConfigProto(device_count={'GPU': 0})) as sess:
+            sess.run(tf.global_variables_initializer())
+            sample = np.random.uniform(-1, 1, size=(1, size, size, 3)).astype(np.float32)
+            sess.run(y, feed_dict={x: sample})
+            times = []
+            for _ in range(repeat):
+                start_time = time.time()
+                sess.run(y, feed_dict={x: sample})
+                times.append(time.time() - start_time)
+    return int(flops), float(np.median(times))
 
 
 class AnimeStyle(object):
 
-    def __init__(self, sess, args):
+    def __init__(self, sess, args, memory=None):
+
+        from tools.utils import check_folder
 
         self.model_name = 'AnimeStyle'
         self.sess = sess
+        # per-phase memory instrumentation; a disabled profiler unless one is passed in
+        self.memory = memory if memory is not None else MemoryProfiler()
+        self.phase = args.phase
         self.checkpoint_dir = args.checkpoint_dir
         self.init_checkpoint_dir = args.init_checkpoint_dir
         self.result_dir = args.result_dir
@@ -27,6 +60,9 @@ class AnimeStyle(object):
         self.epoch = args.epoch
 
         self.batch_size = args.batch_size
+        # a logical batch is processed as accum_steps micro-batches whose gradients are accumulated
+        self.accum_steps = args.accum_steps
+        self.micro_batch_size = self.batch_size // self.accum_steps
         self.save_freq = args.save_freq
 
         self.init_lr = args.init_lr
@@ -46,25 +82,76 @@ class AnimeStyle(object):
         """ Discriminator """
         self.sn = args.sn
         self.val_freq = args.val_freq
+        self.val_mode = args.val_mode
+        self.val_device = args.val_device
+        self.val_fid = args.val_fid
+
+        """ Evaluation """
+        self.fid_size = args.fid_size
+        self.fid_cache = args.fid_cache
+
+        """ Video """
+        self.video_batch = args.video_batch
+        self.video_reuse_threshold = args.video_reuse_threshold
+        self.video_max_side = args.video_max_side
+
+        """ Distillation """
+        self.student_ch = args.student_ch
+        self.student_blocks = args.student_blocks
+        self.distill_epoch = args.distill_epoch
+        self.distill_lr = args.distill_lr
+        self.distill_con_weight = args.distill_con_weight
+        self.distill_color_weight = args.distill_color_weight
+        self.teacher_epoch = args.teacher_epoch
+
+        """ Output """
+        self.out_format = args.out_format
+        self.out_quality = args.out_quality
+        self.save_real = args.save_real
+        self.writer_threads = args.writer_threads
+
+        """ Inference backend """
+        self.backend = args.backend
+        # set by test_epoch for backends other than this session
+        self.inference = None
+
+        """ Latency budget """
+        self.latency_budget = args.latency_budget
+        # longest side test images are decoded and processed at, 0 for full resolution
+        self.max_side = args.max_side
+        self.cost_model = args.cost_model
 
         self.sample_dir = os.path.join(args.sample_dir, self.model_dir)
         check_folder(self.sample_dir)
 
-        self.real = tf.placeholder(tf.float32, [self.batch_size, self.img_size[0], self.img_size[1], self.img_ch], name='real')
-        self.anime = tf.placeholder(tf.float32, [self.batch_size, self.img_size[0], self.img_size[1], self.img_ch], name='anime')
-        self.test_real = tf.placeholder(tf.float32, [1, None, None, self.img_ch], name='test_input')
+        self.test_real = tf.placeholder(tf.float32, [None, None, None, self.img_ch], name='test_input')
+
+        if self.phase in ('train', 'distill'):
+            from tools.data_loader import ImageGenerator
 
-        self.real_image_generator = ImageGenerator('./dataset/train_photo', self.batch_size)
-        self.anime_image_generator = ImageGenerator(f'./dataset/{self.dataset_name}', self.batch_size)
-        self.dataset_num = max(self.real_image_generator.num_images, self.anime_image_generator.num_images)
+            # only GAN training accumulates gradients; distillation steps over whole batches
+            input_batch_size = self.micro_batch_size if self.phase == 'train' else self.batch_size
+            self.real = tf.placeholder(tf.float32, [input_batch_size, self.img_size[0], self.img_size[1], self.img_ch], name='real')
+            self.real_image_generator = ImageGenerator('./dataset/train_photo', input_batch_size)
+            self.dataset_num = self.real_image_generator.num_images
 
-        self.vgg = Vgg19()
+        if self.phase == 'train':
+            self.anime = tf.placeholder(tf.float32, [self.micro_batch_size, self.img_size[0], self.img_size[1], self.img_ch], name='anime')
+            self.anime_image_generator = ImageGenerator(f'./dataset/{self.dataset_name}', self.micro_batch_size)
+            self.dataset_num = max(self.real_image_generator.num_images, self.anime_image_generator.num_images)
+
+        # VGG19 weights are only loaded when a training loss first needs them
+        self._vgg = None
 
         print()
         print("##### Information #####")
+        print("# phase : ", self.phase)
         print("# dataset : ", self.dataset_name)
-        print("# max dataset number : ", self.dataset_num)
+        if self.phase in ('train', 'distill'):
+            print("# max dataset number : ", self.dataset_num)
         print("# batch_size : ", self.batch_size)
+        if self.accum_steps > 1:
+            print("# accum_steps, micro_batch_size : ", self.accum_steps, self.micro_batch_size)
         print("# epoch : ", self.epoch)
         print("# init_epoch : ", self.init_epoch)
         print("# training image size [H, W] : ", self.img_size)
@@ -73,32 +160,61 @@ class AnimeStyle(object):
         print()
 
 
+    @property
+    def vgg(self):
+        if self._vgg is None:
+            from tools.vgg19 import Vgg19
+            self._vgg = Vgg19()
+        return self._vgg
+
+
     def generator(self, x_init, reuse=False, scope='generator'):
         with tf.variable_scope(scope, reuse=reuse):
             return G_net_unet(x_init)
 
 
+    def student_generator(self, x_init, reuse=False, scope='student'):
+        from net.student import G_net_student
+        with tf.variable_scope(scope, reuse=reuse):
+            return G_net_student(x_init, self.student_ch, self.student_blocks)
+
+
     def image_discriminator(self, x_init, reuse=False, scope='image_discriminator'):
+        from net.discriminator import D_net
         with tf.variable_scope(scope, reuse=reuse):
             return D_net(x_init, self.sn)
 
 
     def patch_discriminator(self, x_init, reuse=False, scope='patch_discriminator'):
+        from net.discriminator import patch_D_net
         with tf.variable_scope(scope, reuse=reuse):
             return patch_D_net(x_init, self.sn)
 
 
     def build_model(self):
 
+        """ Define Generator """
+        self.test_generated = self.generator(self.test_real, reuse=False)     # -1 ～ 1
+
+        if self.phase == 'train':
+            self.build_train_model()
+        elif self.phase == 'distill':
+            self.build_distill_model()
+
+
+    def build_train_model(self):
+        from tools.ops import con_loss, color_loss, total_variation_loss, generator_loss, discriminator_loss
+        from tools.patch_extractor import extract_top_k_img_patches_by_sum
+
         """ Define Generator, Discriminator """
-        self.generated = self.generator(self.real, reuse=False)                                           # -1 ～ 1  b, h, w, 3
-        self.generated.set_shape(shape=[self.batch_size, self.img_size[0], self.img_size[1], self.img_ch])
+        self.generated = self.generator(self.real, reuse=True)                                            # -1 ～ 1  b, h, w, 3
+        self.generated.set_shape(shape=[self.micro_batch_size, self.img_size[0], self.img_size[1], self.img_ch])
         # self.recovered_img = self.generator(self.blur, reuse=True)
 
-        self.test_generated = self.generator(self.test_real, reuse=True)     # -1 ～ 1
-
-        self.anime_patches = extract_top_k_img_patches_by_sum(self.anime, 96, 48, self.batch_size * 4)           # 4b, patch_size, patch_size, 3
-        self.generated_patches = extract_top_k_img_patches_by_sum(self.generated, 96, 72, self.batch_size * 4)   # 4b, patch_size, patch_size, 3
+        # patch sizes are tuned for 256x256 training and follow the resolution of progressive stages
+        patch_size, anime_stride, generated_stride = [max(1, int(round(x * self.img_size[0] / 256.))) for x in (96, 48, 72)]
+        self.anime_patches = extract_top_k_img_patches_by_sum(self.anime, patch_size, anime_stride, self.micro_batch_size * 4)           # 4b, patch_size, patch_size, 3
+        self.generated_patches = extract_top_k_img_patches_by_sum(self.generated, patch_size, generated_stride, self.micro_batch_size * 4)   # 4b, patch_size, patch_size, 3
 
         self.anime_patches_gray = tf.reduce_sum(self.anime_patches, axis=-1, keep_dims=True)                     # 4b, patch_size, patch_size, 1
         self.generated_patches_gray = tf.reduce_sum(self.generated_patches, axis=-1, keep_dims=True)             # 4b, patch_size, patch_size, 1
@@ -142,15 +258,109 @@ class AnimeStyle(object):
         self.G_vars = [var for var in self.t_vars if 'generator' in var.name]
         self.D_vars = [var for var in self.t_vars if 'discriminator' in var.name]
 
-        self.init_optim = tf.train.AdamOptimizer(self.init_lr, beta1=0.5, beta2=0.999).minimize(self.init_loss, var_list=self.G_vars)
-        self.G_optim = tf.train.AdamOptimizer(self.g_lr, beta1=0.5, beta2=0.999).minimize(self.Generator_loss, var_list=self.G_vars)
-        self.D_optim = tf.train.AdamOptimizer(self.d_lr, beta1=0.5, beta2=0.999).minimize(self.Discriminator_loss, var_list=self.D_vars)
+        self.init_optim, self.init_zero, self.init_accum = self.minimize(
+            tf.train.AdamOptimizer(self.init_lr, beta1=0.5, beta2=0.999), self.init_loss, self.G_vars, 'init')
+        self.G_optim, self.G_zero, self.G_accum = self.minimize(
+            tf.train.AdamOptimizer(self.g_lr, beta1=0.5, beta2=0.999), self.Generator_loss, self.G_vars, 'G')
+        self.D_optim, self.D_zero, self.D_accum = self.minimize(
+            tf.train.AdamOptimizer(self.d_lr, beta1=0.5, beta2=0.999), self.Discriminator_loss, self.D_vars, 'D')
+
+
+    def minimize(self, optimizer, loss, var_list, name):
+        # returns (apply, zero, accumulate) ops; without accumulation apply is the plain minimize op
+        if self.accum_steps == 1:
+            return optimizer.minimize(loss, var_list=var_list), None, None
+
+        # accumulators are local variables, so checkpoints stay compatible with non-accumulating runs
+        with tf.variable_scope('accumulation/' + name):
+            accumulators = [tf.Variable(tf.zeros(var.shape, dtype=var.dtype.base_dtype), trainable=False,
+                                        collections=[tf.GraphKeys.LOCAL_VARIABLES], name='accum_%d' % i)
+                            for i, var in enumerate(var_list)]
+        grads_and_vars = optimizer.compute_gradients(loss, var_list=var_list)
+
+        zero = tf.group(*[acc.assign(tf.zeros_like(acc)) for acc in accumulators])
+        accumulate = tf.group(*[acc.assign_add(grad / self.accum_steps)
+                                for acc, (grad, _) in zip(accumulators, grads_and_vars) if grad is not None])
+        apply = optimizer.apply_gradients([(acc, var) for acc, (grad, var) in zip(accumulators, grads_and_vars) if grad is not None])
+        return apply, zero, accumulate
+
+
+    def train_feed_dict(self, batch):
+        real_img, anime_img = batch
+        return {self.real: real_img, self.anime: anime_img}
+
+
+    def init_step(self, batches):
+        # one logical init step over accum_steps micro-batches of (real, anime); returns the mean init loss
+        if self.accum_steps == 1:
+            _, v_loss = self.sess.run([self.init_optim, self.init_loss], feed_dict=self.train_feed_dict(batches[0]))
+            return v_loss
+
+        self.sess.run(self.init_zero)
+        losses = [self.sess.run([self.init_accum, self.init_loss], feed_dict=self.train_feed_dict(batch))[1] for batch in batches]
+        self.sess.run(self.init_optim)
+        return np.mean(losses)
+
+
+    def gan_step(self, batches):
+        # one logical D update then G update; returns mean d_img, d_patch, g_img, g_patch losses
+        if self.accum_steps == 1:
+            train_feed_dict = self.train_feed_dict(batches[0])
+
+            # Update D
+            _, d_img_loss, d_patch_loss = self.sess.run([self.D_optim, self.d_img_loss, self.d_patch_loss], feed_dict=train_feed_dict)
+
+            # Update G
+            _, g_img_loss, g_patch_loss = self.sess.run([self.G_optim, self.g_img_loss, self.g_patch_loss], feed_dict=train_feed_dict)
+            return d_img_loss, d_patch_loss, g_img_loss, g_patch_loss
 
+        # Update D
+        self.sess.run(self.D_zero)
+        d_losses = [self.sess.run([self.D_accum, self.d_img_loss, self.d_patch_loss], feed_dict=self.train_feed_dict(batch))[1:]
+                    for batch in batches]
+        self.sess.run(self.D_optim)
+
+        # Update G
+        self.sess.run(self.G_zero)
+        g_losses = [self.sess.run([self.G_accum, self.g_img_loss, self.g_patch_loss], feed_dict=self.train_feed_dict(batch))[1:]
+                    for batch in batches]
+        self.sess.run(self.G_optim)
+
+        d_img_loss, d_patch_loss = np.mean(d_losses, axis=0)
+        g_img_loss, g_patch_loss = np.mean(g_losses, axis=0)
+        return d_img_loss, d_patch_loss, g_img_loss, g_patch_loss
+
+
+
+    def build_distill_model(self):
+        from tools.ops import con_loss, color_loss
+
+        """ Define Teacher, Student """
+        self.teacher_generated = tf.stop_gradient(self.generator(self.real, reuse=True))     # -1 ～ 1  b, h, w, 3
+        self.student_generated = self.student_generator(self.real, reuse=False)
+        self.test_student = self.student_generator(self.test_real, reuse=True)
+
+        self.distill_l1 = tf.reduce_mean(tf.abs(self.teacher_generated - self.student_generated))
+        self.distill_loss = self.distill_l1
+        if self.distill_con_weight > 0:
+            self.distill_loss += self.distill_con_weight * con_loss(self.vgg, self.teacher_generated, self.student_generated)
+        if self.distill_color_weight > 0:
+            self.distill_loss += self.distill_color_weight * color_loss(self.teacher_generated, self.student_generated)
+
+        """ Training """
+        self.t_vars = tf.trainable_variables()
+        self.G_vars = [var for var in self.t_vars if var.name.startswith('generator')]
+        self.S_vars = [var for var in self.t_vars if var.name.startswith('student')]
+
+        self.distill_optim = tf.train.AdamOptimizer(self.distill_lr, beta1=0.5, beta2=0.999).minimize(self.distill_loss, var_list=self.S_vars)
 
 
     def train(self):
+        from tools.utils import check_folder
+
         # initialize all variables
         self.sess.run(tf.global_variables_initializer())
+        self.sess.run(tf.local_variables_initializer())
 
         # saver to save model
         self.saver = tf.train.Saver(max_to_keep=31)
@@ -158,6 +368,7 @@ class AnimeStyle(object):
 
         """ Input Image"""
         real_img_op, anime_img_op = self.real_image_generator.load_images(), self.anime_image_generator.load_images()
+        real_img_op, anime_img_op = self.resize_batch(real_img_op), self.resize_batch(anime_img_op)
 
         # restore check-point if it exits
         could_load, checkpoint_counter = self.load(self.checkpoint_dir)
@@ -174,6 +385,9 @@ class AnimeStyle(object):
                 start_epoch = 1
                 print(" [!] Load failed...")
 
+        validator = self.start_validator() if self.val_mode == 'async' else None
+        gpu_peak_op = tf.contrib.memory_stats.MaxBytesInUse() if tf.test.is_gpu_available() else None
+
         # loop for epoch
         init_mean_loss = []
         mean_loss = []
@@ -181,20 +395,19 @@ class AnimeStyle(object):
         for epoch in range(start_epoch, self.epoch + 1):
 
             for idx in range(int(self.dataset_num / self.batch_size)):
-                anime_img, real_img = self.sess.run([anime_img_op, real_img_op])
-
-
-                train_feed_dict = {
-                    self.real: real_img,
-                    self.anime: anime_img,
-                }
+                # accum_steps micro-batches of (real, anime) make up one logical batch
+                batches = []
+                with self.memory.phase('train/input'):
+                    for _ in range(self.accum_steps):
+                        anime_img, real_img = self.sess.run([anime_img_op, real_img_op])
+                        batches.append((real_img, anime_img))
 
                 if epoch <= self.init_epoch:
                     # Init G
                     start_time = time.time()
 
-
-                    _, v_loss = self.sess.run([self.init_optim, self.init_loss], feed_dict=train_feed_dict)
+                    with self.memory.phase('train/init_step'):
+                        v_loss = self.init_step(batches)
 
                     init_mean_loss.append(v_loss)
 
@@ -207,11 +420,8 @@ class AnimeStyle(object):
                 else:
                     start_time = time.time()
 
-                    # Update D
-                    _, d_img_loss, d_patch_loss = self.sess.run([self.D_optim, self.d_img_loss, self.d_patch_loss], feed_dict=train_feed_dict)
-
-                    # Update G
-                    _, g_img_loss, g_patch_loss = self.sess.run([self.G_optim, self.g_img_loss, self.g_patch_loss], feed_dict=train_feed_dict)
+                    with self.memory.phase('train/gan_step'):
+                        d_img_loss, d_patch_loss, g_img_loss, g_patch_loss = self.gan_step(batches)
 
                     mean_loss.append([d_img_loss, d_patch_loss, g_img_loss, g_patch_loss])
 
@@ -224,28 +434,185 @@ class AnimeStyle(object):
                     if (idx + 1) % 200 == 0:
                         mean_loss.clear()
 
+            print(" [*] Epoch %d peak memory: %s (batch %d = %d x %d)" % (
+                epoch, format_peak_memory(self.sess, gpu_peak_op), self.batch_size, self.accum_steps, self.micro_batch_size))
+
+            if validator is not None and validator.poll() is not None:
+                # the worker died (bad checkpoint, out of memory, missing val dir): validate in the loop from now on
+                print(" [!] Validation worker exited with code %d; validating in the training loop instead" % validator.returncode)
+                validator = None
+
             if epoch == self.init_epoch:
                 self.save(self.init_saver, self.sess, 'init_model', self.init_checkpoint_dir, epoch)
 
 
-            if epoch > self.init_epoch and np.mod(epoch, self.save_freq) == 0:
+            is_val_epoch = epoch > self.init_epoch and np.mod(epoch, self.val_freq) == 0
+
+            # the validation worker reads the generator from the checkpoint, so validation epochs are always saved,
+            # and the last epoch of a progressive stage is always saved, so the next stage continues from it
+            should_save = (epoch > self.init_epoch and (np.mod(epoch, self.save_freq) == 0 or (validator is not None and is_val_epoch))
+                           or epoch == self.epoch)
+            if should_save:
                 self.save(self.saver, self.sess, self.model_name, self.checkpoint_dir, epoch)
 
 
-            if epoch > self.init_epoch and np.mod(epoch, self.val_freq) == 0:
+            if is_val_epoch and validator is None:
                 """ Result Image """
                 val_files = glob('./dataset/{}/*.*'.format('val'))
                 save_path = './{}/{:03d}/'.format(self.sample_dir, epoch)
                 check_folder(save_path)
-                for i, sample_file in enumerate(val_files):
-                    print('val: ' + str(i) + sample_file)
-                    sample_image = np.asarray(load_test_data(sample_file, self.img_size))
-                    test_real, test_generated = self.sess.run([self.test_real, self.test_generated], feed_dict={self.test_real: sample_image})
+                with self.memory.phase('validation'):
+                    self.test_files(val_files, save_path)
+
+        if validator is not None:
+            self.stop_validator(validator)
+
+
+    def resize_batch(self, img_op):
+        # dataset images are resized in the graph when training below their resolution (progressive stages)
+        if img_op.shape.ndims == 4 and img_op.shape.as_list()[1:3] == list(self.img_size):
+            return img_op
+        return tf.image.resize_area(img_op, self.img_size)
+
+
+    def start_validator(self):
+        # validation worker in its own process; it watches the checkpoint folder and validates new checkpoints
+        import subprocess
+        import sys
+        from validate import STOP_FILE
+
+        stop_file = os.path.join(self.sample_dir, STOP_FILE)
+        if os.path.exists(stop_file):
+            os.remove(stop_file)
+
+        env = dict(os.environ)
+        env['CUDA_VISIBLE_DEVICES'] = self.val_device
+        command = [sys.executable, os.path.join(os.path.dirname(os.path.abspath(__file__)), 'validate.py'),
+                   '--checkpoint_dir', os.path.join(self.checkpoint_dir, self.model_dir),
+                   '--sample_dir', self.sample_dir,
+                   '--dataset', self.dataset_name,
+                   '--img_size', str(self.img_size[0]), str(self.img_size[1]),
+                   '--batch_size', str(self.batch_size),
+                   '--val_freq', str(self.val_freq),
+                   '--init_epoch', str(self.init_epoch),
+                   '--out_format', self.out_format,
+                   '--out_quality', str(self.out_quality),
+                   '--save_real', str(int(self.save_real)),
+                   '--mem_budget', str(self.memory.rss_budget),
+                   '--max_side', str(self.max_side),
+                   '--parent_pid', str(os.getpid())]
+        if self.memory.report_path:
+            # the worker is a separate process with its own report next to the trainer's
+            command += ['--mem_report', os.path.splitext(self.memory.report_path)[0] + '_validation.json']
+        if self.val_fid:
+            command += ['--fid', '--fid_size', str(self.fid_size), '--fid_cache', self.fid_cache]
+        print(" [*] Starting validation worker")
+        return subprocess.Popen(command, env=env)
+
+
+    def stop_validator(self, validator):
+        from validate import STOP_FILE
+
+        open(os.path.join(self.sample_dir, STOP_FILE), 'w').close()
+        print(" [*] Waiting for the validation worker to finish the remaining checkpoints...")
+        if validator.wait() != 0:
+            print(" [!] Validation worker exited with code %d; some checkpoints were not validated" % validator.returncode)
+
+
+    def train_distill(self):
+        # train the student generator to reproduce the outputs of a trained teacher checkpoint
+        from tools.utils import check_folder
+        from inference import checkpoint_path, STUDENT_CONFIG
+        import json
 
-                    save_images(test_real, self.dataset_name, save_path + basename(sample_file).split('.')[0] + '_a.jpg', None)
-                    # adjust_brightness_from_photo_to_fake
-                    save_images(test_generated, self.dataset_name, save_path + basename(sample_file).split('.')[0] + '_b.jpg', sample_file)
+        self.sess.run(tf.global_variables_initializer())
+        teacher_saver = tf.train.Saver(var_list=self.G_vars)
+        student_saver = tf.train.Saver(var_list=self.S_vars, max_to_keep=5)
+
+        teacher_path = checkpoint_path(os.path.join(self.checkpoint_dir, self.model_dir), self.teacher_epoch or None)
+        with self.memory.phase('restore'):
+            teacher_saver.restore(self.sess, teacher_path)
+        print(" [*] Teacher: " + teacher_path)
+
+        student_dir = check_folder(self.student_dir)
+        with open(os.path.join(student_dir, STUDENT_CONFIG), 'w') as f:
+            json.dump({'base_ch': self.student_ch, 'num_blocks': self.student_blocks}, f)
 
+        start_epoch = 1
+        ckpt = tf.train.get_checkpoint_state(student_dir)
+        if ckpt and ckpt.model_checkpoint_path:
+            with self.memory.phase('restore'):
+                student_saver.restore(self.sess, ckpt.model_checkpoint_path)
+            start_epoch = int(ckpt.model_checkpoint_path.split('-')[-1]) + 1
+            print(" [*] Load SUCCESS")
+
+        real_img_op = self.real_image_generator.load_images()
+        num_steps = int(self.dataset_num / self.batch_size)
+        mean_loss = []
+
+        for epoch in range(start_epoch, self.distill_epoch + 1):
+            for idx in range(num_steps):
+                real_img = self.sess.run(real_img_op)
+
+                start_time = time.time()
+                with self.memory.phase('distill/step'):
+                    _, loss, l1 = self.sess.run([self.distill_optim, self.distill_loss, self.distill_l1], feed_dict={self.real: real_img})
+                mean_loss.append(loss)
+
+                print("Epoch: %3d Step: %5d / %5d  time: %f s distill_loss: %.8f l1: %.8f mean_loss: %.8f" %
+                      (epoch, idx, num_steps, time.time() - start_time, loss, l1, np.mean(mean_loss)))
+
+                if (idx + 1) % 200 == 0:
+                    mean_loss.clear()
+
+            if np.mod(epoch, self.save_freq) == 0 or epoch == self.distill_epoch:
+                student_saver.save(self.sess, os.path.join(student_dir, self.model_name + '.model'), global_step=epoch)
+
+        return self.distill_report()
+
+
+    def distill_report(self):
+        # parameter count, FLOPs and CPU latency of teacher and student, and the student's fidelity to the teacher
+        from tools.utils import check_folder, load_test_data
+        import json
+        from net.student import G_net_student
+
+        size = self.img_size[0]
+        report = {'image_size': size, 'student_ch': self.student_ch, 'student_blocks': self.student_blocks}
+        networks = [('teacher', self.G_vars, lambda x: G_net_unet(x)),
+                    ('student', self.S_vars, lambda x: G_net_student(x, self.student_ch, self.student_blocks))]
+        for name, var_list, build in networks:
+            flops, latency = profile_network(build, size)
+            report[name] = {'params': int(sum(np.prod(v.shape.as_list()) for v in var_list)),
+                            'flops': flops, 'cpu_latency': latency}
+        report['speedup'] = report['teacher']['cpu_latency'] / report['student']['cpu_latency']
+
+        l1, psnr = [], []
+        for sample_file in glob('./dataset/{}/*.*'.format('test')):
+            sample_image = np.asarray(load_test_data(sample_file, self.img_size))
+            teacher, student = self.sess.run([self.test_generated, self.test_student], feed_dict={self.test_real: sample_image})
+            mse = np.mean(((teacher - student) * 127.5) ** 2)
+            l1.append(float(np.mean(np.abs(teacher - student))))
+            psnr.append(float(10. * np.log10(255. ** 2 / max(mse, 1e-10))))
+        report['fidelity'] = {'images': len(l1), 'l1': float(np.mean(l1)) if l1 else None,
+                              'psnr': float(np.mean(psnr)) if psnr else None}
+
+        print(" [*] teacher: %d params, %.2f GFLOPs, %.1f ms on CPU" % (
+            report['teacher']['params'], report['teacher']['flops'] / 1e9, report['teacher']['cpu_latency'] * 1e3))
+        print(" [*] student: %d params, %.2f GFLOPs, %.1f ms on CPU (x%.2f faster)" % (
+            report['student']['params'], report['student']['flops'] / 1e9, report['student']['cpu_latency'] * 1e3, report['speedup']))
+        print(" [*] fidelity to teacher: PSNR %s dB, L1 %s" % (report['fidelity']['psnr'], report['fidelity']['l1']))
+
+        save_path = check_folder(self.result_dir + os.path.sep + self.model_dir + os.path.sep)
+        with open(save_path + 'distill_report.json', 'w') as f:
+            json.dump(report, f, indent=2)
+        print("Report is saved in " + save_path + 'distill_report.json')
+        return report
+
+
+    @property
+    def student_dir(self):
+        return os.path.join(self.checkpoint_dir, self.model_dir, 'student')
 
 
     @property
@@ -274,7 +641,8 @@ class AnimeStyle(object):
 
         if ckpt and ckpt.model_checkpoint_path:
             ckpt_name = os.path.basename(ckpt.model_checkpoint_path)   # first line
-            self.saver.restore(self.sess, os.path.join(checkpoint_dir, ckpt_name))
+            with self.memory.phase('restore'):
+                self.saver.restore(self.sess, os.path.join(checkpoint_dir, ckpt_name))
             counter = int(ckpt_name.split('-')[-1])
             print(counter)
             print(" [*] Success to read {}".format(os.path.join(checkpoint_dir, ckpt_name)))
@@ -288,7 +656,8 @@ class AnimeStyle(object):
     def load_with_step(self, checkpoint_dir, step):
         print(" [*] Reading checkpoints...")
         checkpoint_dir = os.path.join(checkpoint_dir, self.model_dir)
-        self.saver.restore(self.sess, os.path.join(checkpoint_dir, self.model_name + '.model' + '-' + str(step)))
+        with self.memory.phase('restore'):
+            self.saver.restore(self.sess, os.path.join(checkpoint_dir, self.model_name + '.model' + '-' + str(step)))
         print(" [*] Success to read {}".format(os.path.join(checkpoint_dir, self.model_name + '-' + str(step))))
 
 
@@ -301,7 +670,8 @@ class AnimeStyle(object):
 
         if ckpt and ckpt.model_checkpoint_path:
             ckpt_name = os.path.basename(ckpt.model_checkpoint_path)   # first line
-            self.init_saver.restore(self.sess, os.path.join(checkpoint_dir, ckpt_name))
+            with self.memory.phase('restore'):
+                self.init_saver.restore(self.sess, os.path.join(checkpoint_dir, ckpt_name))
             counter = int(ckpt_name.split('-')[-1])
             print(" [*] Success to read {}".format(os.path.join(checkpoint_dir, ckpt_name)))
             return True, counter
@@ -313,6 +683,8 @@ class AnimeStyle(object):
 
     def test(self):
         # evaluate model given the specific checkpoint
+        from tools.utils import check_folder
+
         tf.global_variables_initializer().run()
 
         self.saver = tf.train.Saver()
@@ -327,37 +699,72 @@ class AnimeStyle(object):
         val_files = glob('./dataset/{}/*.*'.format('test'))
         save_path = self.result_dir + os.path.sep + self.model_dir + os.path.sep
         check_folder(save_path)
-        for i, sample_file in enumerate(val_files):
-            print('val: ' + str(i) + sample_file)
-            sample_image = np.asarray(load_test_data(sample_file, self.img_size))
-            test_real, test_generated = self.sess.run([self.test_real, self.test_generated],
-                                                      feed_dict={self.test_real: sample_image})
-
-            save_images(test_real, self.dataset_name, save_path + basename(sample_file).split('.')[0] + '_a.jpg', None)
-            # adjust_brightness_from_photo_to_fake
-            save_images(test_generated, self.dataset_name, save_path + basename(sample_file).split('.')[0] + '_b.jpg', sample_file)
+        self.test_files(val_files, save_path)
 
 
 
     def test_epoch(self, epoch):
         # evaluate model trained after a specific epoch
-        self.saver = tf.train.Saver()
-        tf.global_variables_initializer().run()
-        self.load_with_step(self.checkpoint_dir, epoch)
+        from tools.utils import check_folder
+
+        if self.backend == 'tf':
+            self.saver = tf.train.Saver()
+            tf.global_variables_initializer().run()
+            self.load_with_step(self.checkpoint_dir, epoch)
+        else:
+            from backends import create_backend
+            if self.inference is not None:
+                self.inference.close()
+            with self.memory.phase('restore'):
+                self.inference = create_backend(self.backend, os.path.join(self.checkpoint_dir, self.model_dir), epoch)
+            print(" [*] Running the generator with the {} backend".format(self.backend))
 
         val_files = glob('./dataset/{}/*.*'.format('test'))
         save_path = self.result_dir + os.path.sep + self.model_dir + os.path.sep + str(epoch) + os.path.sep
         check_folder(save_path)
-        for i, sample_file in enumerate(val_files):
+        self.test_files(val_files, save_path)
+        print("Images are saved in " + save_path)
+
+
+    def run_generator(self, batch):
+        if self.inference is not None:
+            return self.inference.run(batch)
+        return self.sess.run(self.test_generated, feed_dict={self.test_real: batch})
+
+
+    def test_files(self, files, save_path):
+        # generate every file and save the photo (_a) next to the brightness matched result (_b)
+        from image_io import AsyncImageWriter, ImageLoader
+
+        loader = ImageLoader(self.img_size, self.max_side)
+        writer = AsyncImageWriter(self.writer_threads, fmt=self.out_format, quality=self.out_quality, save_real=self.save_real)
+        adaptive = None
+        if self.latency_budget > 0:
+            from adaptive import AdaptiveResolution
+            # every epoch of a model costs the same, but another backend or model does not
+            adaptive = AdaptiveResolution(self.run_generator, self.latency_budget, self.cost_model,
+                                          cost_key='%s:%s' % (self.backend, self.model_dir))
+
+        for i, sample_file in enumerate(files):
             print('val: ' + str(i) + sample_file)
-            sample_image = np.asarray(load_test_data(sample_file, self.img_size))
-            test_real, test_generated = self.sess.run([self.test_real, self.test_generated],
-                                                      feed_dict={self.test_real: sample_image})
+            # sample_image is the loader's reused input buffer; the 8 bit photo is what the writer keeps
+            sample_image, photo = loader.load(sample_file)
+            with self.memory.phase('test_image/%dx%d' % sample_image.shape[2:0:-1]):
+                if adaptive is None:
+                    test_generated = self.run_generator(sample_image)
+                else:
+                    test_generated, info = adaptive(sample_image)
+            if adaptive is not None:
+                print(" [*] processed at %dx%d for %dx%d in %.3f s (budget %.3f s)" % (
+                    info['size'][1], info['size'][0], info['full_size'][1], info['full_size'][0],
+                    info['elapsed'], self.latency_budget))
 
-            save_images(test_real, self.dataset_name, save_path + basename(sample_file).split('.')[0] + '_a.jpg', None)
-            # adjust_brightness_from_photo_to_fake
-            save_images(test_generated, self.dataset_name, save_path + basename(sample_file).split('.')[0] + '_b.jpg', sample_file)
-        print("Images are saved in " + save_path)
+            # brightness is matched against the decoded photo, so the source file is not read again
+            writer.submit(test_generated, photo, save_path + basename(sample_file).split('.')[0])
+
+        writer.close()
+        if adaptive is not None:
+            adaptive.save()
 
 
     def test_all_epochs(self):
@@ -368,3 +775,85 @@ class AnimeStyle(object):
                 epoch = file.split('-')[1].split('.')[0]
                 self.test_epoch(epoch)
 
+
+    def evaluate_checkpoints(self):
+        # rank all kept checkpoints by the FID/KID of the generated test set against the anime dataset
+        from tools.utils import check_folder, load_test_data
+        import json
+        from evaluate import FeatureExtractor, reference_stats, distance
+        from validate import batches
+
+        self.saver = tf.train.Saver()
+        tf.global_variables_initializer().run()
+        ckpt = tf.train.get_checkpoint_state(os.path.join(self.checkpoint_dir, self.model_dir))
+        if not (ckpt and ckpt.all_model_checkpoint_paths):
+            print(" [*] Failed to find a checkpoint")
+            return []
+
+        extractor = FeatureExtractor(self.fid_size, self.batch_size)
+        reference = reference_stats(extractor, './dataset/{}'.format(self.dataset_name), self.fid_cache)
+        test_files = sorted(glob('./dataset/{}/*.*'.format('test')))
+        images = [(f, np.asarray(load_test_data(f, self.img_size))) for f in test_files]
+
+        results = []
+        for path in ckpt.all_model_checkpoint_paths:
+            with self.memory.phase('restore'):
+                self.saver.restore(self.sess, path)
+            generated = []
+            with self.memory.phase('evaluate/generate'):
+                for batch in batches(images, self.batch_size):
+                    generated.extend(self.run_generator(np.concatenate([image for _, image in batch], axis=0)))
+            scores = distance(extractor(generated), reference)
+            scores['epoch'] = int(path.split('-')[-1])
+            results.append(scores)
+            print(" [*] epoch %d: FID %s, KID %s" % (scores['epoch'], scores['fid'], scores['kid']))
+        extractor.close()
+
+        # FID needs more images than feature dimensions to be reliable; KID is unbiased on small sets
+        few_images = len(images) < reference[0].shape[0]
+        available = [m for m in ('fid', 'kid') if any(r[m] is not None for r in results)]
+        metric = None
+        if available:
+            metric = 'kid' if few_images and 'kid' in available else available[0]
+            results.sort(key=lambda r: float('inf') if r[metric] is None else r[metric])
+
+        save_path = self.result_dir + os.path.sep + self.model_dir + os.path.sep
+        check_folder(save_path)
+        with open(save_path + 'evaluation.json', 'w') as f:
+            json.dump(results, f, indent=2)
+        if metric is None:
+            print(" [!] Neither FID nor KID could be computed from {} test images; checkpoints are not ranked".format(len(images)))
+        else:
+            print(" [*] Best epoch by {}: {}".format(metric.upper(), results[0]['epoch']))
+        print("Ranking is saved in " + save_path + 'evaluation.json')
+        return results
+
+
+    def test_video(self, video_path, epoch=None):
+        # cartoonize a video file with the checkpoint of a specific epoch (latest if None)
+        from tools.utils import check_folder
+        from video import VideoCartoonizer
+
+        self.saver = tf.train.Saver()
+        tf.global_variables_initializer().run()
+        if epoch is None:
+            could_load, epoch = self.load(self.checkpoint_dir)
+            if not could_load:
+                print(" [!] Load failed...")
+        else:
+            self.load_with_step(self.checkpoint_dir, epoch)
+
+        save_path = self.result_dir + os.path.sep + self.model_dir + os.path.sep + 'video' + os.path.sep
+        check_folder(save_path)
+        output_path = save_path + basename(video_path).split('.')[0] + '_' + str(epoch) + '.mp4'
+
+        cartoonizer = VideoCartoonizer(self.run_generator, self.img_size, batch_size=self.video_batch,
+                                       reuse_threshold=self.video_reuse_threshold, max_side=self.video_max_side)
+        with self.memory.phase('video'):
+            stats = cartoonizer.run(video_path, output_path)
+
+        print(" [*] %d frames (%d processed, %d reused) at %dx%d in %.2f s -- %.2f frames/s, inference %.2f s" % (
+            stats['frames'], stats['processed'], stats['reused'], stats['working_size'][1], stats['working_size'][0],
+            stats['elapsed'], stats['fps'], stats['inference_time']))
+        print("Video is saved in " + output_path)
+        return stats
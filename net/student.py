@@ -0,0 +1,49 @@
+"""Lightweight student generator distilled from G_net_unet.
+
+Encoder with two stride-2 convolutions, a stack of inverted residual blocks
+with depthwise convolutions at 1/4 resolution, and a resize-convolution
+decoder. Width and depth are configurable; the output has the input size for
+inputs divisible by 4, in [-1, 1].
+"""
+import tensorflow as tf
+
+
+def _conv(x, channels, kernel=3, stride=1, name='conv'):
+    return tf.layers.conv2d(x, channels, kernel, strides=stride, padding='same', use_bias=False, name=name)
+
+
+def _norm_act(x, name='norm', act=True):
+    x = tf.contrib.layers.instance_norm(x, scope=name)
+    return tf.nn.leaky_relu(x, alpha=0.2) if act else x
+
+
+def _upsample(x):
+    h, w = x.shape.as_list()[1:3]
+    size = [h * 2, w * 2] if h and w else tf.shape(x)[1:3] * 2
+    return tf.image.resize_bilinear(x, size)
+
+
+def _inverted_residual(x, channels, expansion=2, name='block'):
+    with tf.variable_scope(name):
+        y = _norm_act(_conv(x, channels * expansion, 1, name='expand'), name='norm_expand')
+        y = tf.layers.separable_conv2d(y, channels, 3, padding='same', use_bias=False, name='depthwise')
+        y = _norm_act(y, name='norm_project', act=False)
+        return x + y
+
+
+def G_net_student(inputs, base_ch=16, num_blocks=4):
+    with tf.variable_scope('encoder'):
+        x = _norm_act(_conv(inputs, base_ch, 7, name='conv_in'), name='norm_in')
+        x = _norm_act(_conv(x, base_ch * 2, 3, 2, name='down1'), name='norm_down1')
+        x = _norm_act(_conv(x, base_ch * 4, 3, 2, name='down2'), name='norm_down2')
+
+    with tf.variable_scope('blocks'):
+        for i in range(num_blocks):
+            x = _inverted_residual(x, base_ch * 4, name='block_%d' % i)
+
+    with tf.variable_scope('decoder'):
+        x = _norm_act(_conv(_upsample(x), base_ch * 2, 3, name='up1'), name='norm_up1')
+        x = _norm_act(_conv(_upsample(x), base_ch, 3, name='up2'), name='norm_up2')
+        x = tf.layers.conv2d(x, 3, 7, padding='same', name='conv_out')
+
+    return tf.tanh(x)
@@ -1,11 +1,14 @@
 import sys
+import time
+import argparse
 import cv2
 from PyQt5.QtWidgets import (QApplication, QMainWindow, QPushButton, QLabel, 
                             QVBoxLayout, QHBoxLayout, QWidget, QFileDialog, 
                             QSlider, QGroupBox, QComboBox, QFrame, QSplitter,
                             QProgressBar, QMessageBox, QToolTip, QStyle)
 from PyQt5.QtGui import QPixmap, QImage, QCursor
-from PyQt5.QtCore import Qt, QSize, QTimer, QPoint
+from PyQt5.QtCore import Qt, QSize, QTimer, QPoint, QThread, pyqtSignal
+from camera import CameraCapture, ResolutionController, draw_overlay
 
 class ModernFrame(QFrame):
     """A custom frame with rounded corners and shadow effect"""
@@ -71,9 +74,73 @@ class StyledButton(QPushButton):
             """)
         self.setCursor(QCursor(Qt.PointingHandCursor))
 
+class LiveWorker(QThread):
+    """Runs the generator on the newest camera frame at an automatically chosen resolution"""
+    # camera frame, cartoon, and the cartoon with the FPS overlay for display
+    frame_ready = pyqtSignal(object, object, object)
+    failed = pyqtSignal(str)
+
+    def __init__(self, generator, capture, target_fps, parent=None):
+        super(LiveWorker, self).__init__(parent)
+        self.generator = generator
+        self.capture = capture
+        self.controller = ResolutionController(target_fps=target_fps)
+        self._running = True
+
+    def run(self):
+        frame_id = 0
+        fps = 0.
+        last_time = time.time()
+        try:
+            while self._running and self.capture.running:
+                latest = self.capture.latest(frame_id)
+                if latest is None:
+                    self.msleep(2)
+                    continue
+                frame_id, frame, capture_time = latest
+
+                h, w = self.controller.size(frame.shape[0], frame.shape[1])
+                start_time = time.time()
+                cartoon = cv2.cvtColor(self.generator.cartoonize(cv2.cvtColor(frame, cv2.COLOR_BGR2RGB), h, w),
+                                       cv2.COLOR_RGB2BGR)
+                now = time.time()
+                self.controller.update(now - start_time)
+
+                fps = 0.9 * fps + 0.1 / max(now - last_time, 1e-6) if fps else 1. / max(now - last_time, 1e-6)
+                last_time = now
+                shown = draw_overlay(cartoon.copy(), fps, now - capture_time, (h, w), self.capture.dropped)
+                self.frame_ready.emit(frame, cartoon, shown)
+            if self._running and self.capture.error:
+                self.failed.emit(self.capture.error)
+        except Exception as e:
+            self.failed.emit(str(e))
+
+    def stop(self):
+        self._running = False
+        self.wait()
+
+class CartoonWorker(QThread):
+    """Runs the generator on a still image off the UI thread, regenerating only what changed since the last run"""
+    done = pyqtSignal(object, object)
+    failed = pyqtSignal(str)
+
+    def __init__(self, renderer, image, parent=None):
+        super(CartoonWorker, self).__init__(parent)
+        self.renderer = renderer
+        self.image = image
+
+    def run(self):
+        try:
+            cartoon, info = self.renderer.render(cv2.cvtColor(self.image, cv2.COLOR_BGR2RGB))
+            self.done.emit(cv2.cvtColor(cartoon, cv2.COLOR_RGB2BGR), info)
+        except Exception as e:
+            self.renderer.invalidate()
+            self.failed.emit(str(e))
+
 class EnhancedCartoonUI(QMainWindow):
-    def __init__(self):
+    def __init__(self, options=None):
         super().__init__()
+        self.options = options
         self.setWindowTitle("Image Cartoonizer")
         self.setGeometry(100, 100, 1200, 700)
         self.setWindowIcon(self.style().standardIcon(QStyle.SP_ComputerIcon))
@@ -148,11 +215,20 @@ class EnhancedCartoonUI(QMainWindow):
             }
         """)
         
-        self.original_image = None
+        # the loaded photo, decoded at reduced scale with --max_side, and its file, read again at full size on save
+        self.input_image = None
+        self.image_path = None
         self.cartoon_image = None
+        self.cartoon_path = None
         
         self.processing = False
         
+        self.generator = None
+        self.renderer = None
+        self.cartoon_worker = None
+        self.camera = None
+        self.live_worker = None
+        
         self.init_ui()
         
         QTimer.singleShot(500, self.show_welcome_message)
@@ -394,10 +470,23 @@ class EnhancedCartoonUI(QMainWindow):
         action_layout.addWidget(self.apply_button)
         action_layout.addWidget(self.save_button)
         
+        live_group = QGroupBox("Live Camera")
+        live_layout = QVBoxLayout(live_group)
+        live_layout.setContentsMargins(15, 25, 15, 15)
+        live_layout.setSpacing(10)
+        
+        self.camera_button = StyledButton("Start Camera", primary=False)
+        self.camera_button.setIcon(self.style().standardIcon(QStyle.SP_MediaPlay))
+        self.camera_button.setIconSize(QSize(20, 20))
+        self.camera_button.setToolTip("Cartoonize your camera feed in real time")
+        self.camera_button.clicked.connect(self.toggle_camera)
+        live_layout.addWidget(self.camera_button)
+        
         controls_layout.addWidget(file_group)
         controls_layout.addWidget(style_group)
         controls_layout.addWidget(params_group)
         controls_layout.addWidget(action_group)
+        controls_layout.addWidget(live_group)
         controls_layout.addStretch()
         
         content_splitter.addWidget(images_frame)
@@ -424,9 +513,16 @@ class EnhancedCartoonUI(QMainWindow):
         
         if file_path:
             try:
-                self.original_image = cv2.imread(file_path)
-                if self.original_image is not None:
-                    self.display_image(self.original_image, self.original_display)
+                from image_io import decode_image
+                # large photos are decoded at a reduced JPEG scale for the preview and the generator input
+                max_side = self.options.max_side if self.options is not None else 1024
+                try:
+                    self.input_image = decode_image(file_path, max_side, rgb=False)
+                    self.image_path = file_path
+                except IOError:
+                    self.input_image, self.image_path = None, None
+                if self.input_image is not None:
+                    self.display_image(self.input_image, self.original_display)
                     self.apply_button.setEnabled(True)
                     
                     QToolTip.showText(
@@ -442,7 +538,13 @@ class EnhancedCartoonUI(QMainWindow):
                 self.show_error(f"Error loading image: {str(e)}")
     
     def apply_cartoon(self):
-        if self.original_image is not None and not self.processing:
+        if self.input_image is not None and not self.processing:
+            try:
+                renderer = self.get_renderer()
+            except Exception as e:
+                self.show_error(f"Could not load the model: {str(e)}")
+                return
+            
             self.processing = True
             self.progress_bar.show()
             self.apply_button.setEnabled(False)
@@ -457,21 +559,31 @@ class EnhancedCartoonUI(QMainWindow):
             # color_intensity = self.color_slider.value()
             # edge_strength = self.edge_slider.value()
             
-            QTimer.singleShot(1500, lambda: self.process_complete(self.original_image))
+            self.cartoon_worker = CartoonWorker(renderer, self.input_image, self)
+            self.cartoon_worker.done.connect(self.process_complete)
+            self.cartoon_worker.failed.connect(self.process_failed)
+            self.cartoon_worker.start()
     
-    def process_complete(self, processed_image):
-        # Place holder for now while I work on figuring out the cartoonization logic
-        self.cartoon_image = processed_image.copy()
-        
-        self.display_image(self.cartoon_image, self.cartoon_display)
-        
+    def finish_processing(self):
+        self.cartoon_worker = None
         self.progress_bar.setValue(100)
         QTimer.singleShot(300, lambda: self.progress_bar.hide())
-        self.save_button.setEnabled(True)
         self.apply_button.setEnabled(True)
         self.load_button.setEnabled(True)
         self.apply_button.setText("Cartoonize!")
         self.processing = False
+    
+    def process_complete(self, processed_image, info):
+        # loading is disabled while processing, so image_path is still the photo that was rendered
+        self.cartoon_image = processed_image
+        self.cartoon_path = self.image_path
+        
+        self.display_image(self.cartoon_image, self.cartoon_display)
+        
+        self.finish_processing()
+        self.save_button.setEnabled(True)
+        self.statusBar().showMessage("%s render of %dx%d: %.0f%% of the tiles in %d region(s), %.2f s" % (
+            info['mode'], info['size'][1], info['size'][0], 100 * info['dirty_fraction'], info['regions'], info['seconds']))
         
         QMessageBox.information(
             self,
@@ -479,6 +591,10 @@ class EnhancedCartoonUI(QMainWindow):
             "Your image has been cartoonized! You can now save it or try different settings."
         )
     
+    def process_failed(self, message):
+        self.finish_processing()
+        self.show_error(f"Cartoonization failed: {message}")
+    
     def animate_progress(self):
         """Animate the progress bar to simulate processing"""
         current_value = self.progress_bar.value()
@@ -499,7 +615,7 @@ class EnhancedCartoonUI(QMainWindow):
             
             if file_path:
                 try:
-                    cv2.imwrite(file_path, self.cartoon_image)
+                    cv2.imwrite(file_path, self.full_resolution_cartoon())
                     QMessageBox.information(
                         self,
                         "Image Saved",
@@ -508,6 +624,84 @@ class EnhancedCartoonUI(QMainWindow):
                 except Exception as e:
                     self.show_error(f"Error saving image: {str(e)}")
     
+    def full_resolution_cartoon(self):
+        # a still image was processed at reduced scale: the saved cartoon gets the size of the original photo
+        if self.cartoon_path is None:
+            return self.cartoon_image
+        from image_io import decode_image
+        h, w = decode_image(self.cartoon_path, rgb=False).shape[:2]
+        if self.cartoon_image.shape[:2] == (h, w):
+            return self.cartoon_image
+        return cv2.resize(self.cartoon_image, (w, h), interpolation=cv2.INTER_LINEAR)
+    
+    def get_generator(self):
+        if self.generator is None:
+            if self.options is None or not self.options.checkpoint_dir:
+                raise IOError("No model checkpoint given, start the UI with --checkpoint_dir")
+            from backends import create_backend
+            self.generator = create_backend(self.options.backend, self.options.checkpoint_dir, self.options.epoch)
+        return self.generator
+    
+    def get_renderer(self):
+        if self.renderer is None:
+            from incremental import IncrementalRenderer
+            max_side = self.options.max_side if self.options is not None else 1024
+            self.renderer = IncrementalRenderer(self.get_generator(), max_side)
+        return self.renderer
+    
+    def toggle_camera(self):
+        if self.live_worker is not None:
+            self.stop_camera()
+            return
+        
+        try:
+            generator = self.get_generator()
+            source = self.options.camera if self.options is not None else '0'
+            self.camera = CameraCapture(source).start()
+        except Exception as e:
+            self.show_error(f"Could not start the camera: {str(e)}")
+            return
+        
+        target_fps = self.options.target_fps if self.options is not None else 15.
+        self.live_worker = LiveWorker(generator, self.camera, target_fps, self)
+        self.live_worker.frame_ready.connect(self.show_live_frame)
+        self.live_worker.failed.connect(self.live_failed)
+        self.live_worker.start()
+        
+        self.camera_button.setText("Stop Camera")
+        self.load_button.setEnabled(False)
+        self.apply_button.setEnabled(False)
+    
+    def stop_camera(self):
+        if self.live_worker is not None:
+            self.live_worker.stop()
+            self.live_worker = None
+        if self.camera is not None:
+            self.camera.stop()
+            self.camera = None
+        
+        self.camera_button.setText("Start Camera")
+        self.load_button.setEnabled(True)
+        self.apply_button.setEnabled(self.input_image is not None)
+    
+    def show_live_frame(self, frame, cartoon, shown):
+        # the overlay is only displayed; Save writes the clean cartoon
+        self.cartoon_image = cartoon
+        self.cartoon_path = None
+        self.display_image(frame, self.original_display)
+        self.display_image(shown, self.cartoon_display)
+        self.save_button.setEnabled(True)
+    
+    def live_failed(self, message):
+        self.stop_camera()
+        self.show_error(f"Live camera stopped: {message}")
+    
+    def closeEvent(self, event):
+        self.stop_camera()
+        if self.cartoon_worker is not None:
+            self.cartoon_worker.wait()
+        super().closeEvent(event)
+    
     def show_error(self, message):
         """Display an error message"""
         QMessageBox.critical(self, "Error", message)
@@ -552,7 +746,23 @@ class EnhancedCartoonUI(QMainWindow):
         """)
 
 
-app = QApplication(sys.argv)
-window = EnhancedCartoonUI()
-window.show()
-sys.exit(app.exec_())
\ No newline at end of file
+def parse_args():
+    parser = argparse.ArgumentParser(description="Image Cartoonizer")
+    parser.add_argument('--checkpoint_dir', type=str, default='',
+                        help='model checkpoint folder, e.g. checkpoint/AnimeStyle_TWR_g300.0_d300.0_con1.5_color15.0_tv1.0')
+    parser.add_argument('--epoch', type=int, default=None, help='checkpoint epoch to load, latest if omitted')
+    parser.add_argument('--backend', type=str, default='tf', choices=['tf', 'onnx'], help='inference runtime')
+    parser.add_argument('--max_side', type=int, default=1024,
+                        help='longest side a still image is processed at, 0 for full size; the saved result keeps the full size')
+    parser.add_argument('--camera', type=str, default='0', help='camera index, or a video file used as the camera')
+    parser.add_argument('--target_fps', type=float, default=15., help='frame rate the live resolution is tuned for')
+    # Qt consumes its own arguments from the rest
+    return parser.parse_known_args()
+
+
+if __name__ == '__main__':
+    options, qt_args = parse_args()
+    app = QApplication(sys.argv[:1] + qt_args)
+    window = EnhancedCartoonUI(options)
+    window.show()
+    sys.exit(app.exec_())
\ No newline at end of file
@@ -0,0 +1,187 @@
+"""Out-of-process validation worker.
+
+Started by AnimeStyle.train (--val_mode async) as a separate process. It
+watches the checkpoint folder, and for every new checkpoint of a validation
+epoch restores the generator into its own session, generates the validation
+set in batches, writes the _a/_b images and a metrics.json next to them, and
+appends the metrics to <sample_dir>/metrics.jsonl. The validation images are
+decoded once and kept in memory across checkpoints. The worker exits when
+the trainer creates the stop file (after validating what is left) or when
+the trainer process disappears.
+"""
+import argparse
+import json
+import os
+import time
+from glob import glob
+from os.path import basename
+
+import numpy as np
+
+STOP_FILE = '.train_done'
+
+
+def parse_args():
+    desc = "AnimeStyle validation worker"
+    parser = argparse.ArgumentParser(description=desc)
+
+    parser.add_argument('--checkpoint_dir', type=str, required=True, help='model specific checkpoint folder to watch')
+    parser.add_argument('--sample_dir', type=str, required=True, help='model specific folder for validation results')
+    parser.add_argument('--dataset', type=str, default='TWR', help='dataset name')
+    parser.add_argument('--val_dir', type=str, default='./dataset/val', help='validation images')
+    parser.add_argument('--img_size', type=int, nargs=2, default=[256, 256], help='size of input image')
+    parser.add_argument('--batch_size', type=int, default=4, help='validation images per generator run')
+    parser.add_argument('--val_freq', type=int, default=5, help='validate checkpoints of epochs divisible by this')
+    parser.add_argument('--init_epoch', type=int, default=10, help='checkpoints up to this epoch are skipped')
+    parser.add_argument('--poll', type=float, default=5., help='seconds between checkpoint folder scans')
+    parser.add_argument('--threads', type=int, default=2, help='intra/inter op threads of the validation session')
+    parser.add_argument('--fid', action='store_true', help='also report FID/KID against the anime dataset')
+    parser.add_argument('--fid_size', type=int, default=224, help='image size fed to VGG19 for FID/KID features')
+    parser.add_argument('--fid_cache', type=str, default='fid_cache', help='folder for cached reference statistics')
+    parser.add_argument('--out_format', type=str, default='jpg', help='format of saved validation images')
+    parser.add_argument('--out_quality', type=int, default=95, help='encoding quality 0-100 of saved jpg/webp images')
+    parser.add_argument('--save_real', type=int, default=1, help='also save the input photo (_a)')
+    parser.add_argument('--max_side', type=int, default=0, help='longest side validation images are processed at, 0 for full size')
+    parser.add_argument('--mem_report', type=str, default='', help='write peak memory per phase to this JSON file')
+    parser.add_argument('--mem_budget', type=float, default=0., help='fail when a phase exceeds this peak RSS in MB')
+    parser.add_argument('--parent_pid', type=int, default=0, help='exit when this process is gone')
+
+    return parser.parse_args()
+
+
+def pending_epochs(checkpoint_dir, sample_dir, done, val_freq, init_epoch):
+    # the checkpoint state file is only updated once a save has completed, so listed checkpoints are safe to read
+    import tensorflow as tf
+
+    ckpt = tf.train.get_checkpoint_state(checkpoint_dir)
+    if not ckpt:
+        return []
+    epochs = []
+    for path in ckpt.all_model_checkpoint_paths:
+        epoch = int(path.split('-')[-1])
+        if epoch > init_epoch and epoch % val_freq == 0 and epoch not in done:
+            # validated by an earlier worker, e.g. of a previous progressive training stage
+            if os.path.exists(os.path.join(sample_dir, '{:03d}'.format(epoch), 'metrics.json')):
+                continue
+            epochs.append(epoch)
+    return sorted(epochs)
+
+
+def parent_alive(pid):
+    if not pid:
+        return True
+    try:
+        os.kill(pid, 0)
+    except OSError:
+        return False
+    return True
+
+
+def load_val_images(val_dir, img_size, max_side=0):
+    from image_io import load_image
+
+    images = []
+    for sample_file in sorted(glob(os.path.join(val_dir, '*.*'))):
+        images.append((sample_file, load_image(sample_file, img_size, max_side)))
+    return images
+
+
+def batches(images, batch_size):
+    # only images of the same working size can share a batch
+    by_shape = {}
+    for sample_file, image in images:
+        by_shape.setdefault(image.shape, []).append((sample_file, image))
+    for group in by_shape.values():
+        for i in range(0, len(group), batch_size):
+            yield group[i:i + batch_size]
+
+
+def validate_epoch(generator, images, epoch, args, evaluator=None):
+    from image_io import AsyncImageWriter
+
+    save_path = os.path.join(args.sample_dir, '{:03d}'.format(epoch)) + os.path.sep
+    if not os.path.exists(save_path):
+        os.makedirs(save_path)
+
+    start_time = time.time()
+    writer = AsyncImageWriter(fmt=args.out_format, quality=args.out_quality, save_real=bool(args.save_real))
+    l1, saturation, generated_all = [], [], []
+    for batch in batches(images, args.batch_size):
+        real = np.concatenate([image for _, image in batch], axis=0)
+        generated = generator.run(real)
+        for (sample_file, image), fake in zip(batch, generated):
+            writer.submit(fake, image, save_path + basename(sample_file).split('.')[0])
+
+            if evaluator is not None:
+                generated_all.append(fake)
+            rgb = (fake + 1.) / 2.
+            l1.append(float(np.mean(np.abs(fake - image[0]))))
+            saturation.append(float(np.mean(rgb.max(axis=-1) - rgb.min(axis=-1))))
+    writer.close()
+
+    metrics = {'epoch': epoch, 'images': len(l1), 'seconds': time.time() - start_time,
+               'content_l1': float(np.mean(l1)) if l1 else None,
+               'saturation': float(np.mean(saturation)) if saturation else None}
+    if evaluator is not None:
+        from evaluate import distance
+        extractor, reference = evaluator
+        scores = distance(extractor(generated_all), reference)
+        metrics['fid'], metrics['kid'] = scores['fid'], scores['kid']
+    with open(save_path + 'metrics.json', 'w') as f:
+        json.dump(metrics, f, indent=2)
+    with open(os.path.join(args.sample_dir, 'metrics.jsonl'), 'a') as f:
+        f.write(json.dumps(metrics) + '\n')
+    return metrics
+
+
+"""main"""
+def main():
+    args = parse_args()
+    from inference import GeneratorSession, checkpoint_path
+    from memprof import MemoryProfiler
+
+    memory = MemoryProfiler(args.mem_report, args.mem_budget)
+
+    stop_file = os.path.join(args.sample_dir, STOP_FILE)
+    done = set()
+    generator = None
+    images = None
+    evaluator = None
+
+    while True:
+        # read the stop flag before scanning, so checkpoints saved just before it are still validated
+        stopping = os.path.exists(stop_file) or not parent_alive(args.parent_pid)
+        for epoch in pending_epochs(args.checkpoint_dir, args.sample_dir, done, args.val_freq, args.init_epoch):
+            path = checkpoint_path(args.checkpoint_dir, epoch)
+            if generator is None:
+                with memory.phase('graph_build'):
+                    generator = GeneratorSession(args.checkpoint_dir, epoch, threads=args.threads)
+                memory.attach(generator.sess)
+                images = load_val_images(args.val_dir, args.img_size, args.max_side)
+                if args.fid:
+                    from evaluate import FeatureExtractor, reference_stats
+                    extractor = FeatureExtractor(args.fid_size, args.batch_size, threads=args.threads)
+                    evaluator = (extractor, reference_stats(extractor, './dataset/{}'.format(args.dataset), args.fid_cache))
+            else:
+                with memory.phase('restore'):
+                    generator.restore(path)
+            with memory.phase('validation'):
+                metrics = validate_epoch(generator, images, epoch, args, evaluator)
+            memory.save()
+            print(" [*] val epoch %d: %d images in %.2f s, content_l1 %s, saturation %s" % (
+                epoch, metrics['images'], metrics['seconds'], metrics['content_l1'], metrics['saturation']))
+            done.add(epoch)
+        if stopping:
+            break
+        time.sleep(args.poll)
+
+    if generator is not None:
+        generator.close()
+    if evaluator is not None:
+        evaluator[0].close()
+    memory.close()
+    print(" [*] Validation worker finished")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,160 @@
+"""Video cartoonization.
+
+Frames are decoded, run through the generator in batches and encoded on three
+overlapping stages (decoder thread -> inference on the calling thread ->
+encoder thread). A frame that is nearly identical to the last frame sent to
+the generator reuses that frame's output instead of being processed again.
+"""
+import queue
+import threading
+import time
+
+import cv2
+import numpy as np
+
+from inference import working_size, to_input, to_output
+
+_END = object()
+
+
+def change_metric(thumb_a, thumb_b):
+    # mean absolute difference of two small grayscale thumbnails, in 0-255 units
+    return float(np.mean(np.abs(thumb_a.astype(np.int16) - thumb_b.astype(np.int16))))
+
+
+def thumbnail(frame_bgr, size=(64, 36)):
+    return cv2.resize(cv2.cvtColor(frame_bgr, cv2.COLOR_BGR2GRAY), size, interpolation=cv2.INTER_AREA)
+
+
+class VideoCartoonizer(object):
+
+    def __init__(self, infer_fn, img_size, batch_size=4, reuse_threshold=1.5, max_side=0, queue_size=32):
+        # infer_fn maps a float32 batch [b, h, w, 3] in [-1, 1] to the generated batch in [-1, 1]
+        self.infer_fn = infer_fn
+        self.img_size = img_size
+        self.batch_size = batch_size
+        self.reuse_threshold = reuse_threshold
+        self.max_side = max_side
+        self.queue_size = queue_size
+
+
+    def run(self, video_path, output_path):
+        capture = cv2.VideoCapture(video_path)
+        if not capture.isOpened():
+            raise IOError("Could not open video " + video_path)
+
+        fps = capture.get(cv2.CAP_PROP_FPS) or 25.
+        frame_w = int(capture.get(cv2.CAP_PROP_FRAME_WIDTH))
+        frame_h = int(capture.get(cv2.CAP_PROP_FRAME_HEIGHT))
+        h, w = working_size(frame_h, frame_w, self.img_size, self.max_side)
+
+        writer = cv2.VideoWriter(output_path, cv2.VideoWriter_fourcc(*'mp4v'), fps, (frame_w, frame_h))
+        if not writer.isOpened():
+            capture.release()
+            raise IOError("Could not open video writer " + output_path)
+
+        decoded = queue.Queue(maxsize=self.queue_size)
+        generated = queue.Queue(maxsize=self.queue_size)
+        stats = {'frames': 0, 'processed': 0, 'reused': 0, 'inference_time': 0.}
+        errors = []
+        stop = threading.Event()
+
+        def put_decoded(item):
+            # gives up once the inference loop has stopped, so a full queue never blocks the decoder forever
+            while not stop.is_set():
+                try:
+                    decoded.put(item, timeout=0.1)
+                    return True
+                except queue.Full:
+                    pass
+            return False
+
+        def decode():
+            # item: (frame input or None when the previous output is reused)
+            last_thumb = None
+            try:
+                while not stop.is_set():
+                    ret, frame = capture.read()
+                    if not ret:
+                        break
+                    thumb = thumbnail(frame)
+                    if last_thumb is not None and change_metric(thumb, last_thumb) < self.reuse_threshold:
+                        put_decoded(None)
+                        continue
+                    last_thumb = thumb
+                    put_decoded(to_input(cv2.cvtColor(frame, cv2.COLOR_BGR2RGB), h, w))
+            except Exception as e:
+                errors.append(e)
+            finally:
+                put_decoded(_END)
+
+        def encode():
+            try:
+                while True:
+                    item = generated.get()
+                    if item is _END:
+                        break
+                    writer.write(cv2.cvtColor(to_output(item, frame_h, frame_w), cv2.COLOR_RGB2BGR))
+            except Exception as e:
+                errors.append(e)
+                # keep draining so the inference loop never blocks on a full queue
+                while generated.get() is not _END:
+                    pass
+
+        decoder = threading.Thread(target=decode, daemon=True)
+        encoder = threading.Thread(target=encode, daemon=True)
+        start_time = time.time()
+        decoder.start()
+        encoder.start()
+
+        last_output = None
+        pending = []
+        finished = False
+        try:
+            while not finished:
+                item = decoded.get()
+                if item is _END:
+                    finished = True
+                else:
+                    pending.append(item)
+
+                keyframes = [x for x in pending if x is not None]
+                if not pending or (len(keyframes) < self.batch_size and not finished):
+                    continue
+
+                outputs = []
+                if keyframes:
+                    infer_start = time.time()
+                    outputs = list(self.infer_fn(np.stack(keyframes)))
+                    stats['inference_time'] += time.time() - infer_start
+                    stats['processed'] += len(keyframes)
+
+                for x in pending:
+                    if x is not None:
+                        last_output = outputs.pop(0)
+                    else:
+                        stats['reused'] += 1
+                    generated.put(last_output)
+                    stats['frames'] += 1
+                pending = []
+        finally:
+            # also on an inference error: stop the decoder, unblock it, let the encoder finish and release both files
+            stop.set()
+            while decoder.is_alive():
+                try:
+                    decoded.get(timeout=0.1)
+                except queue.Empty:
+                    pass
+            decoder.join()
+            generated.put(_END)
+            encoder.join()
+            capture.release()
+            writer.release()
+
+        if errors:
+            raise errors[0]
+
+        stats['elapsed'] = time.time() - start_time
+        stats['fps'] = stats['frames'] / max(stats['elapsed'], 1e-8)
+        stats['working_size'] = [h, w]
+        return stats